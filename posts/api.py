@@ -0,0 +1,168 @@
+"""Read-only JSON API (v1) over the feeds and single posts.
+
+Rows are fetched with ``values()`` and serialized straight from the
+dicts, never as model instances. Feeds are cursor-paginated; ``fields``
+selects the keys of each item and ``limit`` the page size. Annotated
+fields such as ``comment_count`` are only computed when asked for. Every
+response carries a ``Server-Timing`` header splitting database time
+from serialization time.
+"""
+import time
+
+from django.core.files.storage import default_storage
+from django.http import JsonResponse
+
+from .models import Comment, Group, Post, User, comment_count
+from .pagination import PAGE_SIZE, CursorPaginator
+
+MAX_LIMIT = 100
+
+# Public field name -> lookup relative to a post.
+POST_FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'pub_date': 'pub_date',
+    'author': 'author__username',
+    'group': 'group__slug',
+    'image': 'image',
+    'comment_count': None,  # annotated, only on request
+}
+COMMENT_FIELDS = {
+    'id': 'id',
+    'author': 'author__username',
+    'text': 'text',
+    'created': 'created',
+}
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _error(message, status):
+    return JsonResponse({'error': message}, status=status,
+                        json_dumps_params={'ensure_ascii': False})
+
+
+def _selected(request, available):
+    raw = request.GET.get('fields')
+    if not raw:
+        return [name for name, lookup in available.items()
+                if lookup is not None]
+    names = [name.strip() for name in raw.split(',') if name.strip()]
+    unknown = sorted(set(names) - set(available))
+    if unknown:
+        raise BadRequest('Неизвестные поля: %s' % ', '.join(unknown))
+    return names
+
+
+def _limit(request):
+    try:
+        limit = int(request.GET.get('limit', PAGE_SIZE))
+    except ValueError:
+        raise BadRequest('limit должен быть числом')
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def _lean(queryset, names, fields, prefix=''):
+    """``values()`` of ``queryset`` with a lookup for each selected name."""
+    lookups = {}
+    for name in names:
+        if name == 'comment_count':
+            queryset = queryset.annotate(
+                comment_count=comment_count(prefix + 'id'))
+            lookups[name] = 'comment_count'
+        else:
+            lookups[name] = prefix + fields[name]
+    return queryset, lookups
+
+
+def _item(row, lookups):
+    item = {name: row[lookup] for name, lookup in lookups.items()}
+    if 'image' in item:
+        item['image'] = (default_storage.url(item['image'])
+                         if item['image'] else None)
+    return item
+
+
+def _respond(data, started, fetched):
+    response = JsonResponse(data, json_dumps_params={'ensure_ascii': False})
+    serialized = time.perf_counter()
+    response['Server-Timing'] = 'db;dur=%.3f, serialize;dur=%.3f' % (
+        (fetched - started) * 1000, (serialized - fetched) * 1000)
+    return response
+
+
+def _page(request, queryset, fields, ordering, prefix=''):
+    started = time.perf_counter()
+    try:
+        names = _selected(request, fields)
+        limit = _limit(request)
+    except BadRequest as error:
+        return _error(str(error), 400)
+    queryset, lookups = _lean(queryset, names, fields, prefix)
+    # The ordering columns travel along for the cursor.
+    keys = [name.lstrip('-') for name in ordering]
+    rows = queryset.values(*keys, *lookups.values())
+    paginator = CursorPaginator(rows, limit, ordering)
+    page = paginator.get_page(request.GET.get('cursor'))
+    fetched = time.perf_counter()
+    return _respond({
+        'results': [_item(row, lookups) for row in page],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    }, started, fetched)
+
+
+def _posts(request, queryset):
+    return _page(request, queryset, POST_FIELDS, ('-pub_date', '-id'))
+
+
+def index(request):
+    return _posts(request, Post.objects.all())
+
+
+def group_posts(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'id', flat=True).first()
+    if group_id is None:
+        return _error('Сообщество не найдено', 404)
+    return _posts(request, Post.objects.filter(group_id=group_id))
+
+
+def profile(request, username):
+    author_id = User.objects.filter(username=username).values_list(
+        'id', flat=True).first()
+    if author_id is None:
+        return _error('Пользователь не найден', 404)
+    return _posts(request, Post.objects.filter(author_id=author_id))
+
+
+def follow_index(request):
+    if not request.user.is_authenticated:
+        return _error('Требуется авторизация', 401)
+    # Cursor on the timeline entry; item fields come from its post.
+    return _page(request, request.user.timeline.all(), POST_FIELDS,
+                 ('-pub_date', '-id'), prefix='post__')
+
+
+def post_detail(request, post_id):
+    started = time.perf_counter()
+    try:
+        names = _selected(request, POST_FIELDS)
+    except BadRequest as error:
+        return _error(str(error), 400)
+    queryset, lookups = _lean(Post.objects.filter(pk=post_id),
+                              names, POST_FIELDS)
+    row = queryset.values(*lookups.values()).first()
+    fetched = time.perf_counter()
+    if row is None:
+        return _error('Запись не найдена', 404)
+    return _respond(_item(row, lookups), started, fetched)
+
+
+def post_comments(request, post_id):
+    if not Post.objects.filter(pk=post_id).exists():
+        return _error('Запись не найдена', 404)
+    return _page(request, Comment.objects.filter(post_id=post_id),
+                 COMMENT_FIELDS, ('created', 'id'))
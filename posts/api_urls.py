@@ -0,0 +1,25 @@
+from django.urls import path
+
+from . import api
+
+
+urlpatterns = [
+     path('posts/',
+          api.index,
+          name='api_index'),
+     path('posts/<int:post_id>/',
+          api.post_detail,
+          name='api_post'),
+     path('posts/<int:post_id>/comments/',
+          api.post_comments,
+          name='api_post_comments'),
+     path('follow/',
+          api.follow_index,
+          name='api_follow_index'),
+     path('groups/<slug:slug>/posts/',
+          api.group_posts,
+          name='api_group_posts'),
+     path('users/<str:username>/posts/',
+          api.profile,
+          name='api_profile'),
+]
@@ -0,0 +1,228 @@
+"""Cache backends that report hits and misses to posts.metrics.
+
+``TwoTierCache`` puts a bounded per-process LRU in front of a cache that
+all workers share (any Django backend, configured under ``SHARED``).
+Reads are served locally when possible and fall through to the shared
+tier; writes go to both. Other workers' local copies are not reached by
+a write or delete, so the local tier suits keys whose value never
+changes: ours are versioned (see posts.caching and posts.cards), and
+invalidation happens by bumping a version held in the shared tier only.
+Keys starting with a ``SHARED_ONLY`` prefix, such as those versions,
+bypass the local tier, and ``LOCAL_TIMEOUT`` bounds how long any local
+copy is trusted.
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache.backends import filebased, locmem
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+
+from . import metrics
+
+_missing = object()
+
+
+class MetricsMixin:
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _missing, version)
+        if value is _missing:
+            metrics.record_cache(0, 1)
+            return default
+        metrics.record_cache(1, 0)
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        found = super().get_many(keys, version)
+        metrics.record_cache(len(found), len(keys) - len(found))
+        return found
+
+
+class LocMemCache(MetricsMixin, locmem.LocMemCache):
+    pass
+
+
+class FileBasedCache(filebased.FileBasedCache):
+    """File cache that culls at most once per ``CULL_INTERVAL`` seconds.
+
+    Django's lists the whole cache directory on every write to count the
+    entries, so writes slow down as the cache fills; here a write only
+    pays for that when the interval has passed. The directory may run
+    past ``MAX_ENTRIES`` in between.
+    """
+
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        self._cull_interval = params.get('OPTIONS', {}).get(
+            'CULL_INTERVAL', 60)
+        self._next_cull = 0
+
+    def _cull(self):
+        now = time.monotonic()
+        if now < self._next_cull:
+            return
+        self._next_cull = now + self._cull_interval
+        super()._cull()
+
+
+class LocalTier:
+    """Process-wide LRU of pickled values with per-tier lookup stats."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (expires, pickled)
+        self.lock = threading.Lock()
+        self.stats = {'local': {'hit': 0, 'miss': 0},
+                      'shared': {'hit': 0, 'miss': 0}}
+
+    def get_many(self, keys):
+        found = {}
+        now = time.time()
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                if entry[0] <= now:
+                    del self.entries[key]
+                    continue
+                self.entries.move_to_end(key)
+                found[key] = entry[1]
+        return {key: pickle.loads(value) for key, value in found.items()}
+
+    def set_many(self, data, lifetime):
+        expires = time.time() + lifetime
+        pickled = {key: pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+                   for key, value in data.items()}
+        with self.lock:
+            for key, value in pickled.items():
+                self.entries[key] = (expires, value)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def count(self, tier, hits, misses):
+        with self.lock:
+            self.stats[tier]['hit'] += hits
+            self.stats[tier]['miss'] += misses
+
+
+# Cache instances are per thread; their local tier is per process.
+_local_tiers = {}
+_local_tiers_lock = threading.Lock()
+
+
+class TwoTierCache(BaseCache):
+
+    def __init__(self, name, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        shared = dict(options['SHARED'])
+        self.shared = import_string(shared.pop('BACKEND'))(
+            shared.pop('LOCATION', ''), shared)
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 60)
+        self.shared_only = tuple(options.get('SHARED_ONLY', ()))
+        with _local_tiers_lock:
+            self.local = _local_tiers.setdefault(
+                name, LocalTier(options.get('LOCAL_MAX_ENTRIES', 1000)))
+
+    def stats(self):
+        with self.local.lock:
+            return {tier: dict(counts)
+                    for tier, counts in self.local.stats.items()}
+
+    def _local_key(self, key, version):
+        if key.startswith(self.shared_only):
+            return None
+        return self.make_key(key, version)
+
+    def _lifetime(self, timeout):
+        timeout = self.shared.get_backend_timeout(timeout)
+        if timeout is None:
+            return self.local_timeout
+        return min(timeout - time.time(), self.local_timeout)
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        local_keys = {key: self._local_key(key, version) for key in keys}
+        cached = self.local.get_many(
+            [local for local in local_keys.values() if local])
+        found = {key: cached[local_keys[key]] for key in keys
+                 if local_keys[key] in cached}
+        self.local.count('local', len(found),
+                         sum(1 for local in local_keys.values() if local)
+                         - len(found))
+        missing = [key for key in keys if key not in found]
+        if missing:
+            fetched = self.shared.get_many(missing, version)
+            self.local.count('shared', len(fetched),
+                             len(missing) - len(fetched))
+            self.local.set_many(
+                {local_keys[key]: value for key, value in fetched.items()
+                 if local_keys[key]},
+                self.local_timeout)
+            found.update(fetched)
+        metrics.record_cache(len(found), len(keys) - len(found))
+        return found
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version).get(key, default)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version)
+        self.local.set_many(
+            {local: data[key] for key, local in (
+                (key, self._local_key(key, version)) for key in data)
+             if local and key not in failed},
+            self._lifetime(timeout))
+        return failed
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version)
+        if added:
+            local = self._local_key(key, version)
+            if local:
+                self.local.set_many({local: value}, self._lifetime(timeout))
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.shared.incr(key, delta, version)
+        self.local.delete_many([self.make_key(key, version)])
+        return value
+
+    def has_key(self, key, version=None):
+        return key in self.get_many([key], version)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self.shared.delete_many(keys, version)
+        self.local.delete_many([self.make_key(key, version) for key in keys])
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version)
+
+    def clear(self):
+        self.shared.clear()
+        self.local.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
@@ -0,0 +1,82 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Post
+
+VERSION_KEY = 'posts:version:%s'
+# Moved by every build_suggestions run; profiles show the result.
+SUGGESTIONS_SCOPE = 'suggestions'
+
+
+def scopes_for_post(post):
+    """Cache scopes whose rendered feeds may contain ``post``."""
+    scopes = ['index', 'author:%s' % post.author_id]
+    if post.group_id:
+        scopes.append('group:%s' % post.group_id)
+    return scopes
+
+
+def scopes_for_author(user_id):
+    """Cache scopes whose feeds show the author of ``user_id``'s posts."""
+    groups = Post.objects.filter(author_id=user_id).exclude(
+        group=None).order_by().values_list('group_id', flat=True).distinct()
+    return (['index', 'author:%s' % user_id]
+            + ['group:%s' % group_id for group_id in groups])
+
+
+def scopes_for_group(group_id):
+    """Cache scopes whose feeds show the group ``group_id``."""
+    authors = Post.objects.filter(group_id=group_id).order_by().values_list(
+        'author_id', flat=True).distinct()
+    return (['index', 'group:%s' % group_id]
+            + ['author:%s' % author_id for author_id in authors])
+
+
+def get_versions(scopes):
+    """Current version of every scope, initialising missing ones.
+
+    Fresh versions start from the clock rather than 1, so a scope whose
+    counter was evicted never reuses a number that old fragments carry.
+    """
+    keys = [VERSION_KEY % scope for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = {key: int(time.time() * 1000)
+               for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump(scopes):
+    """Invalidate every fragment rendered under ``scopes``."""
+    for scope in scopes:
+        key = VERSION_KEY % scope
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, int(time.time() * 1000), timeout=None)
+
+
+def audience(user):
+    # The only viewer-dependent bit of a feed is the author-only edit
+    # button, so anonymous readers share one variant.
+    if user.is_authenticated:
+        return 'user:%s' % user.pk
+    return 'anon'
+
+
+def feed_fragment(request, paginator, page, *scopes):
+    """Template context for ``{% cache fragment_ttl feed fragment_key %}``."""
+    if getattr(paginator, 'is_cursor', False):
+        position = 'cursor:%s' % (request.GET.get('cursor') or '')
+    else:
+        position = 'page:%s' % page.number
+    versions = '.'.join(str(version) for version in get_versions(scopes))
+    return {
+        'fragment_key': '|'.join(
+            [','.join(scopes), position, audience(request.user), versions]),
+        'fragment_ttl': settings.POSTS_FRAGMENT_CACHE_TTL,
+    }
@@ -0,0 +1,70 @@
+"""Rendered post cards, cached one post at a time.
+
+A card's key is derived from what the feed query already loads: the
+post's ``updated`` stamp (bumped by edits and comments, see
+posts.signals), its comment count, the author's username and the group.
+Any of those changing yields a new key, so nothing is ever invalidated;
+stale cards simply age out. A feed fetches all its cards with one
+``get_many`` and renders only the misses.
+
+The edit button is the one viewer-specific part of a card. Cached cards
+carry a marker in its place, swapped for the live button on assembly.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from . import thumbnails
+
+CARD_KEY = 'posts:card:%s:%s'
+CARD_TEMPLATE = 'includes/post_item.html'
+EDIT_MARKER = '<!-- edit-button -->'
+
+
+def card_key(post):
+    group = post.group and (post.group.slug, post.group.title)
+    digest = hashlib.md5(repr((
+        post.updated, getattr(post, 'comment_count', None),
+        post.author.username, group,
+    )).encode()).hexdigest()
+    return CARD_KEY % (post.pk, digest)
+
+
+def _render(post):
+    """The card of ``post`` and whether it may be cached."""
+    # A card showing the original in place of a pending thumbnail would
+    # outlive the thumbnail; render it again next time instead.
+    served = thumbnails.served_originals()
+    html = render_to_string(CARD_TEMPLATE, {
+        'post': post,
+        'edit_button': mark_safe(EDIT_MARKER),
+    })
+    return html, thumbnails.served_originals() == served
+
+
+def _edit_button(post, user):
+    if user is None or user.pk != post.author_id:
+        return ''
+    return render_to_string('includes/post_edit_button.html', {'post': post})
+
+
+def render_cards(posts, user=None):
+    """HTML of the cards of ``posts`` as ``user`` sees them."""
+    posts = list(posts)
+    keys = [card_key(post) for post in posts]
+    cards = cache.get_many(keys)
+    fresh = {}
+    for post, key in zip(posts, keys):
+        if key not in cards:
+            html, cacheable = _render(post)
+            cards[key] = html
+            if cacheable:
+                fresh[key] = html
+    if fresh:
+        cache.set_many(fresh, settings.POSTS_CARD_CACHE_TTL)
+    return mark_safe(''.join(
+        cards[key].replace(EDIT_MARKER, _edit_button(post, user))
+        for post, key in zip(posts, keys)))
@@ -0,0 +1,86 @@
+"""Conditional GET for the post, profile and group pages.
+
+Each page gets one indexed row lookup plus the version counters of the
+feed caches (posts.caching), which posts.signals moves on every post,
+comment, rename and follow that the page shows. Nothing here grows with
+the number of posts. A matching ``If-None-Match`` is answered with 304
+before the view renders anything. No Last-Modified is sent: a timestamp
+cannot stand for the follow state or the counters, and whole seconds
+miss a comment made in the same one, so ``If-Modified-Since`` alone
+never yields a 304.
+"""
+import hashlib
+from functools import wraps
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from .caching import SUGGESTIONS_SCOPE, audience, get_versions
+from .models import Group, Post, User
+
+STATS = ('stats__followers', 'stats__following', 'stats__posts')
+
+
+def _etag(request, *parts):
+    # Pages differ per viewer (nav bar, edit links), so is the tag.
+    digest = hashlib.md5(
+        repr((audience(request.user),) + parts).encode()).hexdigest()
+    return quote_etag(digest)
+
+
+def post_validators(request, username, post_id):
+    # Post.updated covers edits and comments (see posts.signals); the
+    # names are joined in so that a renamed author or group shows too.
+    row = Post.objects.filter(
+        id=post_id, author__username=username
+    ).order_by().values_list(
+        'updated', 'group__title', 'group__slug',
+        *('author__' + name for name in STATS),
+    ).first()
+    if row is None:
+        return None
+    return _etag(request, *row)
+
+
+def profile_validators(request, username):
+    row = User.objects.filter(username=username).order_by().values_list(
+        'id', *STATS).first()
+    if row is None:
+        return None
+    scopes = ['author:%s' % row[0]]
+    if request.user.is_authenticated:
+        # The follow button and the suggestions box.
+        scopes += ['viewer:%s' % request.user.pk, SUGGESTIONS_SCOPE]
+    return _etag(request, *row, *get_versions(scopes))
+
+
+def group_validators(request, slug):
+    row = Group.objects.filter(slug=slug).order_by().values_list(
+        'id', 'title', 'description').first()
+    if row is None:
+        return None
+    return _etag(request, *row, *get_versions(['group:%s' % row[0]]))
+
+
+def conditional(validators):
+    """Answer GET/HEAD with 304 when ``validators`` say nothing changed.
+
+    ``validators`` takes the view's arguments and returns the ETag, or
+    None to let the view run (and usually 404).
+    """
+    def decorator(view):
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            etag = validators(request, *args, **kwargs)
+            if etag is None:
+                return view(request, *args, **kwargs)
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response.setdefault('ETag', etag)
+            return response
+        return inner
+    return decorator
@@ -0,0 +1,63 @@
+from django.db.models import Count, F
+
+from .models import Follow, Post, User, UserStats
+
+COUNTERS = ('followers', 'following', 'posts')
+
+
+def increment(user_id, **deltas):
+    """Atomically add ``deltas`` to a user's counters.
+
+    A missing row is created only for increments: decrements arrive while
+    a user is being deleted, and counters never go below zero, leaving
+    any such drift to ``reconcile``.
+    """
+    changes = {name: F(name) + delta for name, delta in deltas.items()}
+    floors = {'%s__gte' % name: -delta
+              for name, delta in deltas.items() if delta < 0}
+    stats = UserStats.objects.filter(user_id=user_id, **floors)
+    if stats.update(**changes) or floors:
+        return
+    UserStats.objects.bulk_create([UserStats(user_id=user_id)],
+                                  ignore_conflicts=True)
+    stats.update(**changes)
+
+
+def actual_counts():
+    """Recount every counter from the source tables, keyed by user id."""
+    counts = {}
+    sources = (
+        ('followers', Follow, 'author'),
+        ('following', Follow, 'user'),
+        ('posts', Post, 'author'),
+    )
+    for name, model, field in sources:
+        rows = model.objects.values_list(field).annotate(
+            total=Count('id')).order_by()
+        for user_id, total in rows:
+            counts.setdefault(user_id, {})[name] = total
+    return counts
+
+
+def reconcile(batch_size=500, dry_run=False):
+    """Repair drifted or missing counters; returns the number of users."""
+    counts = actual_counts()
+    existing = UserStats.objects.in_bulk()
+    missing, drifted = [], []
+    for user_id in User.objects.values_list('id', flat=True).iterator():
+        expected = {name: counts.get(user_id, {}).get(name, 0)
+                    for name in COUNTERS}
+        stats = existing.get(user_id)
+        if stats is None:
+            missing.append(UserStats(user_id=user_id, **expected))
+        elif any(getattr(stats, name) != value
+                 for name, value in expected.items()):
+            for name, value in expected.items():
+                setattr(stats, name, value)
+            drifted.append(stats)
+    if not dry_run:
+        UserStats.objects.bulk_create(missing, batch_size=batch_size,
+                                      ignore_conflicts=True)
+        UserStats.objects.bulk_update(drifted, COUNTERS,
+                                      batch_size=batch_size)
+    return len(missing) + len(drifted)
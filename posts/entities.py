@@ -0,0 +1,84 @@
+"""In-process identity cache of groups by slug and users by username.
+
+The rows behind these lookups are tiny, read on almost every request and
+hardly ever change, so each worker keeps a bounded LRU of their column
+values and builds a fresh instance per hit (callers may modify it).
+posts.signals forgets an entry whenever its row is saved or deleted,
+which also bumps a per-model version in the shared cache (posts.caching);
+every hit checks that version, so other workers drop their copies on
+their next lookup. ``POSTS_ENTITY_CACHE_TTL`` only bounds how long an
+entry lives. Unknown keys are not cached.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.http import Http404
+
+from . import caching
+from .models import Group, User
+
+
+class EntityCache:
+
+    def __init__(self, model, field):
+        self.model = model
+        self.field = field
+        self.names = [f.attname for f in model._meta.concrete_fields]
+        self.pk_index = self.names.index(model._meta.pk.attname)
+        self.scope = 'entities:%s' % model._meta.label_lower
+        self.entries = OrderedDict()  # key -> (expires, version, values)
+        self.lock = threading.Lock()
+
+    def _load(self, key):
+        return self.model._default_manager.filter(
+            **{self.field: key}).values_list(*self.names).first()
+
+    def get(self, key):
+        """The instance whose ``field`` is ``key``, or None."""
+        now = time.monotonic()
+        version, = caching.get_versions([self.scope])
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now and entry[1] == version:
+                self.entries.move_to_end(key)
+                values = entry[2]
+            else:
+                values = None
+        if values is None:
+            values = self._load(key)
+            if values is None:
+                return None
+            with self.lock:
+                self.entries[key] = (now + settings.POSTS_ENTITY_CACHE_TTL,
+                                     version, values)
+                self.entries.move_to_end(key)
+                while len(self.entries) > settings.POSTS_ENTITY_CACHE_SIZE:
+                    self.entries.popitem(last=False)
+        return self.model.from_db('default', self.names, values)
+
+    def get_or_404(self, key):
+        instance = self.get(key)
+        if instance is None:
+            raise Http404('No %s matches the given query.'
+                          % self.model._meta.object_name)
+        return instance
+
+    def forget(self, instance):
+        # By pk as well, as a rename leaves the row under its old key.
+        with self.lock:
+            self.entries.pop(getattr(instance, self.field), None)
+            stale = [key for key, (_, _, values) in self.entries.items()
+                     if values[self.pk_index] == instance.pk]
+            for key in stale:
+                del self.entries[key]
+        caching.bump([self.scope])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+groups = EntityCache(Group, 'slug')
+users = EntityCache(User, 'username')
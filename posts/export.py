@@ -0,0 +1,143 @@
+"""Streaming export of a user's posts and comments.
+
+Everything here is a generator over chunked ``iterator()`` queries, so
+memory use does not depend on the size of the account: rows are turned
+into NDJSON or CSV lines one at a time, and the optional zip archive is
+written to an unseekable sink that is drained after every entry chunk.
+"""
+import csv
+import json
+import time
+import zipfile
+
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Comment, Post
+
+FORMATS = ('ndjson', 'csv')
+CSV_FIELDS = ('type', 'id', 'post', 'group', 'text', 'date', 'image')
+CHUNK_SIZE = 2000
+BUFFER_SIZE = 64 * 1024
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'zip': 'application/zip',
+}
+
+
+def records(user):
+    """Every post, then every comment, written by ``user``."""
+    posts = Post.objects.filter(author=user).order_by('id').values_list(
+        'id', 'group__slug', 'text', 'pub_date', 'image')
+    for pk, group, text, pub_date, image in posts.iterator(CHUNK_SIZE):
+        yield {'type': 'post', 'id': pk, 'group': group, 'text': text,
+               'date': pub_date, 'image': image or None}
+    comments = Comment.objects.filter(author=user).order_by('id').values_list(
+        'id', 'post_id', 'text', 'created')
+    for pk, post_id, text, created in comments.iterator(CHUNK_SIZE):
+        yield {'type': 'comment', 'id': pk, 'post': post_id, 'text': text,
+               'date': created}
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+class _Line:
+    """csv.writer target that hands back the line it was given."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.DictWriter(_Line(), CSV_FIELDS)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def encoded(user, fmt):
+    """The export as bytes, coalesced into ``BUFFER_SIZE`` chunks."""
+    render = ndjson_lines if fmt == 'ndjson' else csv_lines
+    buffer, size = [], 0
+    for line in render(records(user)):
+        data = line.encode()
+        buffer.append(data)
+        size += len(data)
+        if size >= BUFFER_SIZE:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def image_names(user):
+    return (Post.objects.filter(author=user).exclude(image='')
+            .exclude(image=None).order_by().values_list('image', flat=True)
+            .distinct().iterator(CHUNK_SIZE))
+
+
+class _Sink:
+    """Unseekable file for ZipFile: collects output until drained."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _entry(name, compress_type):
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = compress_type
+    return info
+
+
+def zip_chunks(user, fmt):
+    """The export plus every image of ``user`` as a streamed zip."""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w') as archive:
+        content = _entry('%s.%s' % (user.username, fmt), zipfile.ZIP_DEFLATED)
+        with archive.open(content, 'w', force_zip64=True) as entry:
+            for chunk in encoded(user, fmt):
+                entry.write(chunk)
+                yield sink.drain()
+        for name in image_names(user):
+            if not default_storage.exists(name):
+                continue
+            # Images are compressed already; store them as they are.
+            info = _entry(name, zipfile.ZIP_STORED)
+            with default_storage.open(name) as source, \
+                    archive.open(info, 'w', force_zip64=True) as entry:
+                for chunk in source.chunks():
+                    entry.write(chunk)
+                    yield sink.drain()
+    yield sink.drain()
+
+
+def chunks(user, fmt, images=False):
+    """Byte chunks of the export of ``user`` in ``fmt``, zipped if asked."""
+    if images:
+        return (chunk for chunk in zip_chunks(user, fmt) if chunk)
+    return encoded(user, fmt)
+
+
+def filename(user, fmt, images=False):
+    return '%s.%s' % (user.username, 'zip' if images else fmt)
+
+
+def content_type(fmt, images=False):
+    return CONTENT_TYPES['zip' if images else fmt]
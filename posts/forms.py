@@ -33,6 +33,16 @@ class PostForm(forms.ModelForm):
             ),
         }
 
+    def __init__(self, *args, rejected_uploads=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rejected_uploads = rejected_uploads or {}
+
+    def clean(self):
+        # Files the upload handler refused never reach request.FILES.
+        for field, error in self.rejected_uploads.items():
+            self.add_error(field, error)
+        return super().clean()
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
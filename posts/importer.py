@@ -0,0 +1,372 @@
+"""Bulk import of groups, posts, comments and follows from NDJSON.
+
+One JSON object per line, told apart by ``type``::
+
+    {"type": "group", "slug": "cats", "title": "Коты", "description": ""}
+    {"type": "post", "id": 7, "author": "leo", "group": "cats",
+     "text": "...", "date": "2020-01-01T10:00:00Z", "image": null}
+    {"type": "comment", "post": 7, "author": "tolstoy", "text": "...",
+     "date": "2020-01-01T11:00:00Z"}
+    {"type": "follow", "user": "tolstoy", "author": "leo"}
+
+Post ``id`` values are the source system's and are only used to attach
+comments from the same file, so a post must have one and come before
+its comments.
+``export_content`` output imports as-is when ``default_author`` names
+the exported user.
+
+Rows are buffered and written with ``bulk_create`` in dependency order,
+one transaction per batch. Authors and groups are resolved through
+in-memory maps that only query for names not seen yet. Rows that
+already exist are skipped, which makes re-running an import a no-op:
+groups by slug, posts by (author, date, text), comments by (post,
+author, date) and follows by pair. Posts repeated within the file are
+reported with the line they repeat. Signals do not fire for bulk
+writes, so each batch updates the timeline, the search index and the
+cache versions itself. Counters are reconciled once at the end.
+"""
+import json
+import time
+from collections import Counter, defaultdict, deque
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models import F, Max, OuterRef, Subquery
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import caching, counters, media, search, timeline, trending
+from .models import Comment, Follow, Group, Post, User
+
+TYPES = ('group', 'post', 'comment', 'follow')
+
+
+class InvalidRecord(Exception):
+    pass
+
+
+def _date(value):
+    parsed = parse_datetime(value) if isinstance(value, str) else None
+    if parsed is None:
+        raise InvalidRecord('bad or missing date: %r' % (value,))
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _bulk_insert(model, objects, stamps, key):
+    """``bulk_create`` that keeps the given ``auto_now(_add)`` values.
+
+    Those fields are overwritten with "now" on insert, so they are put
+    back with one ``executemany`` UPDATE. Returns the objects with their
+    primary keys. Without RETURNING (SQLite) the rows are found again by
+    the ``key`` fields among ids above the old maximum; ids only grow,
+    so rows sharing a key come back in insertion order.
+    """
+    if not objects:
+        return objects
+    fields = [model._meta.get_field(name) for name in stamps]
+    wanted = [[field.get_db_prep_save(getattr(obj, field.attname),
+                                      connection)
+               for field in fields] for obj in objects]
+    floor = model.objects.aggregate(floor=Max('id'))['floor'] or 0
+    model.objects.bulk_create(objects)
+    if objects[0].pk is None:
+        waiting = defaultdict(deque)
+        for obj in objects:
+            waiting[tuple(getattr(obj, name) for name in key)].append(obj)
+        rows = model.objects.filter(id__gt=floor, **{
+            name + '__in': {values[i] for values in waiting}
+            for i, name in enumerate(key)
+        }).order_by('id').values_list('id', *key)
+        for pk, *values in rows:
+            queue = waiting.get(tuple(values))
+            if queue:
+                queue.popleft().pk = pk
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            'UPDATE %s SET %s WHERE id = %%s' % (
+                quote(model._meta.db_table),
+                ', '.join('%s = %%s' % quote(field.column)
+                          for field in fields)),
+            [values + [obj.pk] for obj, values in zip(objects, wanted)])
+    return objects
+
+
+class Importer:
+
+    def __init__(self, batch_size=500, create_users=False,
+                 default_author=None):
+        self.batch_size = batch_size
+        self.create_users = create_users
+        self.default_author = default_author
+        self.users = {}
+        self.groups = {}
+        self.posts = {}  # source post id -> database id
+        self.post_lines = {}  # (author, date, text) -> line it came from
+        self.buffers = {name: [] for name in TYPES}
+        self.created = Counter()
+        self.skipped = Counter()
+        self.errors = []
+        self.started = None
+
+    @property
+    def rows(self):
+        return sum(self.created[kind] + self.skipped[kind] for kind in TYPES)
+
+    def run(self, lines):
+        self.started = time.perf_counter()
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                kind = record.get('type')
+                if kind not in TYPES:
+                    raise InvalidRecord('unknown type %r' % (kind,))
+            except (ValueError, AttributeError, InvalidRecord) as error:
+                self.errors.append((number, str(error)))
+                continue
+            record['line'] = number
+            self.buffers[kind].append(record)
+            if sum(map(len, self.buffers.values())) >= self.batch_size:
+                self.flush()
+        self.flush()
+        counters.reconcile()
+        return self
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return self.rows / elapsed if elapsed else 0
+
+    def flush(self):
+        with transaction.atomic():
+            self.resolve_users()
+            self.resolve_groups()
+            self.import_groups()
+            self.import_posts()
+            self.import_comments()
+            self.import_follows()
+
+    def skip(self, kind, record, reason=None):
+        self.skipped[kind] += 1
+        if reason:
+            self.errors.append((record['line'], reason))
+
+    def author_of(self, record, key='author'):
+        return record.get(key) or self.default_author
+
+    def resolve_users(self):
+        names = set()
+        for record in self.buffers['post'] + self.buffers['comment']:
+            names.add(self.author_of(record))
+        for record in self.buffers['follow']:
+            names.update((record.get('user'), record.get('author')))
+        missing = {name for name in names
+                   if name and name not in self.users}
+        if not missing:
+            return
+        self.users.update(User.objects.filter(
+            username__in=missing).values_list('username', 'id'))
+        unknown = missing - set(self.users)
+        if unknown and self.create_users:
+            password = make_password(None)
+            User.objects.bulk_create(
+                [User(username=name, password=password)
+                 for name in sorted(unknown)])
+            self.users.update(User.objects.filter(
+                username__in=unknown).values_list('username', 'id'))
+            self.created['user'] += len(unknown)
+
+    def resolve_groups(self):
+        slugs = {record['group'] for record in self.buffers['post']
+                 if record.get('group')}
+        slugs.update(record.get('slug') for record in self.buffers['group'])
+        missing = {slug for slug in slugs
+                   if slug and slug not in self.groups}
+        if missing:
+            self.groups.update(Group.objects.filter(
+                slug__in=missing).values_list('slug', 'id'))
+
+    def import_groups(self):
+        new = {}
+        for record in self.buffers['group']:
+            slug = record.get('slug')
+            if not slug:
+                self.skip('group', record, 'no slug')
+            elif slug in self.groups or slug in new:
+                self.skip('group', record)
+            else:
+                new[slug] = Group(
+                    slug=slug, title=record.get('title') or slug,
+                    description=record.get('description') or '')
+        self.buffers['group'] = []
+        if not new:
+            return
+        Group.objects.bulk_create(new.values())
+        self.groups.update(Group.objects.filter(
+            slug__in=new).values_list('slug', 'id'))
+        self.created['group'] += len(new)
+
+    def import_posts(self):
+        candidates = []
+        for record in self.buffers['post']:
+            author_id = self.users.get(self.author_of(record))
+            try:
+                # Comments refer to posts by id: a post without one
+                # could only be matched by accident.
+                if record.get('id') is None:
+                    raise InvalidRecord('no id')
+                if author_id is None:
+                    raise InvalidRecord('unknown author %r'
+                                        % self.author_of(record))
+                if record.get('group') and record['group'] not in self.groups:
+                    raise InvalidRecord('unknown group %r' % record['group'])
+                pub_date = _date(record.get('date'))
+            except InvalidRecord as error:
+                self.skip('post', record, str(error))
+                continue
+            candidates.append((record, Post(
+                author_id=author_id,
+                group_id=self.groups.get(record.get('group')),
+                text=record.get('text') or '',
+                image=record.get('image') or None,
+                pub_date=pub_date,
+                updated=pub_date,
+            )))
+        self.buffers['post'] = []
+        if not candidates:
+            return
+
+        # Two posts of an author in the same second are not unusual;
+        # the text tells them apart.
+        existing = dict(
+            ((author_id, pub_date, text), pk)
+            for pk, author_id, pub_date, text in Post.objects.filter(
+                author_id__in={post.author_id for _, post in candidates},
+                pub_date__in={post.pub_date for _, post in candidates},
+            ).values_list('id', 'author_id', 'pub_date', 'text'))
+        new, duplicates = {}, []
+        for record, post in candidates:
+            key = (post.author_id, post.pub_date, post.text)
+            if key in existing:
+                # Reported only when this very file had it first.
+                line = self.post_lines.get(key)
+                self.skip('post', record,
+                          line and 'same post as line %s' % line)
+                self.posts[record.get('id')] = existing[key]
+            elif key in new:
+                self.skip('post', record, 'same post as line %s'
+                          % new[key][0]['line'])
+                duplicates.append((record, key))
+            else:
+                new[key] = (record, post)
+        _bulk_insert(Post, [post for _, post in new.values()],
+                     ('pub_date', 'updated'), ('author_id', 'text'))
+        for key, (record, post) in new.items():
+            self.posts[record.get('id')] = post.pk
+            self.post_lines[key] = record['line']
+        for record, key in duplicates:
+            self.posts[record.get('id')] = new[key][1].pk
+        new_ids = [post.pk for _, post in new.values()]
+        images = Counter(post.image.name for _, post in new.values()
+                         if post.image)
+        for name, count in images.items():
+            media.acquire(name, count)
+        timeline.fan_out_posts(new_ids)
+        search.index_posts(new_ids)
+        scopes = set()
+        for _, post in new.values():
+            scopes.update(caching.scopes_for_post(post))
+        caching.bump(scopes)
+        self.created['post'] += len(new)
+
+    def import_comments(self):
+        candidates = []
+        for record in self.buffers['comment']:
+            author_id = self.users.get(self.author_of(record))
+            post_id = self.posts.get(record.get('post'))
+            try:
+                if author_id is None:
+                    raise InvalidRecord('unknown author %r'
+                                        % self.author_of(record))
+                if post_id is None:
+                    raise InvalidRecord('unknown post %r'
+                                        % record.get('post'))
+                created = _date(record.get('date'))
+            except InvalidRecord as error:
+                self.skip('comment', record, str(error))
+                continue
+            candidates.append((record, Comment(
+                post_id=post_id, author_id=author_id,
+                text=record.get('text') or '', created=created)))
+        self.buffers['comment'] = []
+        if not candidates:
+            return
+
+        existing = set(Comment.objects.filter(
+            post_id__in={comment.post_id for _, comment in candidates},
+            created__in={comment.created for _, comment in candidates},
+        ).values_list('post_id', 'author_id', 'created'))
+        new = []
+        for record, comment in candidates:
+            key = (comment.post_id, comment.author_id, comment.created)
+            if key in existing:
+                self.skip('comment', record)
+            else:
+                existing.add(key)
+                new.append(comment)
+        _bulk_insert(Comment, new, ('created',),
+                     ('post_id', 'author_id', 'text'))
+        # Comments touch their post (see posts.signals).
+        post_ids = {comment.post_id for comment in new}
+        latest = Comment.objects.filter(post=OuterRef('pk')).order_by(
+            '-created').values('created')[:1]
+        Post.objects.filter(pk__in=post_ids).update(
+            updated=Greatest(F('updated'), Subquery(latest)))
+        scopes = set()
+        for post in Post.objects.filter(pk__in=post_ids).only(
+                'author_id', 'group_id'):
+            scopes.update(caching.scopes_for_post(post))
+        caching.bump(scopes)
+        trending.record_comments(
+            (comment.post_id, comment.created) for comment in new)
+        self.created['comment'] += len(new)
+
+    def import_follows(self):
+        pairs = {}
+        for record in self.buffers['follow']:
+            user_id = self.users.get(record.get('user'))
+            author_id = self.users.get(record.get('author'))
+            if user_id is None or author_id is None:
+                self.skip('follow', record, 'unknown user in %r/%r' % (
+                    record.get('user'), record.get('author')))
+            elif user_id == author_id or (user_id, author_id) in pairs:
+                self.skip('follow', record)
+            else:
+                pairs[(user_id, author_id)] = record
+        self.buffers['follow'] = []
+        if not pairs:
+            return
+
+        existing = set(Follow.objects.filter(
+            user_id__in={user_id for user_id, _ in pairs},
+            author_id__in={author_id for _, author_id in pairs},
+        ).values_list('user_id', 'author_id'))
+        new = [pair for pair in pairs if pair not in existing]
+        self.skipped['follow'] += len(pairs) - len(new)
+        Follow.objects.bulk_create(
+            [Follow(user_id=user_id, author_id=author_id)
+             for user_id, author_id in new],
+            ignore_conflicts=True)
+        follow_ids = [
+            pk for pk, user_id, author_id in Follow.objects.filter(
+                user_id__in={user_id for user_id, _ in new},
+                author_id__in={author_id for _, author_id in new},
+            ).values_list('id', 'user_id', 'author_id')
+            if (user_id, author_id) in pairs
+            and (user_id, author_id) not in existing]
+        timeline.add_follows(follow_ids)
+        self.created['follow'] += len(new)
@@ -0,0 +1,143 @@
+import json
+import random
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+
+from posts.models import Comment, Post, User
+
+from .bench_routes import percentile
+
+MARKER = 'bench_contention'
+
+# What a stock SQLite connection gets: rollback journal, full fsync and
+# the Python driver's 5 s busy timeout.
+STOCK_PRAGMAS = {
+    'journal_mode': 'delete',
+    'synchronous': 'full',
+    'busy_timeout': 5000,
+}
+
+
+class Worker(threading.Thread):
+
+    def __init__(self, action, deadline):
+        super().__init__()
+        self.action = action
+        self.deadline = deadline
+        self.timings = []
+        self.locked = 0
+
+    def run(self):
+        try:
+            while time.perf_counter() < self.deadline:
+                started = time.perf_counter()
+                try:
+                    self.action()
+                except OperationalError as error:
+                    if 'locked' not in str(error):
+                        raise
+                    self.locked += 1
+                    continue
+                self.timings.append((time.perf_counter() - started) * 1000)
+        finally:
+            connection.close()
+
+
+class Command(BaseCommand):
+    help = ('Run reader and writer threads against the database for a few '
+            'seconds and report throughput, latency and "database is '
+            'locked" errors, with the tuned pragmas and with stock ones. '
+            'Run it against a seed_bench database; the rows it writes '
+            'are deleted afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--profile', choices=('tuned', 'stock'),
+                            action='append',
+                            help='Profiles to run (default: both)')
+        parser.add_argument('--output', help='Write the JSON report here')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('This benchmark is for SQLite')
+        self.users = list(User.objects.values_list('id', flat=True)[:200])
+        self.posts = list(Post.objects.order_by('-id').values_list(
+            'id', flat=True)[:1000])
+        if not (self.users and self.posts):
+            raise CommandError('No data to benchmark: run seed_bench first')
+        report = {}
+        try:
+            for profile in options['profile'] or ('stock', 'tuned'):
+                report[profile] = self.run_profile(profile, options)
+        finally:
+            self.clean_up()
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as stream:
+                stream.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def run_profile(self, profile, options):
+        if profile == 'stock':
+            pragmas = override_settings(POSTS_SQLITE_PRAGMAS=STOCK_PRAGMAS)
+        else:
+            pragmas = override_settings()
+        with pragmas:
+            # New connections, so the profile's pragmas are applied.
+            connection.close()
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                journal_mode = cursor.fetchone()[0]
+            deadline = time.perf_counter() + options['seconds']
+            readers = [Worker(self.read, deadline)
+                       for _ in range(options['readers'])]
+            writers = [Worker(self.write, deadline)
+                       for _ in range(options['writers'])]
+            for worker in readers + writers:
+                worker.start()
+            for worker in readers + writers:
+                worker.join()
+            connection.close()
+        return {
+            'journal_mode': journal_mode,
+            'reads': self.summary(readers, options['seconds']),
+            'writes': self.summary(writers, options['seconds']),
+        }
+
+    def summary(self, workers, seconds):
+        timings = [timing for worker in workers for timing in worker.timings]
+        return {
+            'threads': len(workers),
+            'per_second': round(len(timings) / seconds, 1),
+            'p50_ms': round(statistics.median(timings), 3) if timings else None,
+            'p95_ms': round(percentile(timings, 0.95), 3) if timings else None,
+            'locked': sum(worker.locked for worker in workers),
+        }
+
+    def read(self):
+        # The index page: one page of the feed and its total.
+        feed = Post.objects.for_feed()
+        list(feed[:10])
+        feed.count()
+
+    def write(self):
+        # new_post and add_comment in equal measure, signals included.
+        if random.random() < 0.5:
+            Post.objects.create(author_id=random.choice(self.users),
+                                text=MARKER)
+        else:
+            Comment.objects.create(post_id=random.choice(self.posts),
+                                   author_id=random.choice(self.users),
+                                   text=MARKER)
+
+    def clean_up(self):
+        Comment.objects.filter(text=MARKER).delete()
+        Post.objects.filter(text=MARKER).delete()
@@ -0,0 +1,110 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from posts.models import Comment, Follow, Group, Post, User
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Show query plans and latency of the hot feed queries with and '
+            'without the hot-path indexes. Runs in a transaction that is '
+            'rolled back, so the database is left untouched.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, metavar='POSTS',
+                            help='Seed this many posts before measuring')
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['seed']:
+                    self.seed(options['seed'])
+                queries = self.hot_queries()
+                after = self.measure(queries, options['repeat'], 'after')
+                self.drop_indexes()
+                before = self.measure(queries, options['repeat'], 'before')
+                raise Rollback
+        except Rollback:
+            pass
+        for name in queries:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for label, results in (('before', before), ('after', after)):
+                plan, seconds = results[name]
+                self.stdout.write('  %-6s %8.3f ms  %s' % (
+                    label, seconds * 1000, plan))
+
+    def seed(self, posts):
+        # bulk_create does not return primary keys on SQLite: re-read them.
+        User.objects.bulk_create(
+            [User(username='bench_index_%s' % i)
+             for i in range(max(posts // 50, 2))])
+        users = list(User.objects.filter(
+            username__startswith='bench_index_').values_list('id', flat=True))
+        Group.objects.bulk_create(
+            [Group(title='bench %s' % i, slug='bench-index-%s' % i,
+                   description='') for i in range(max(posts // 500, 1))])
+        groups = list(Group.objects.filter(
+            slug__startswith='bench-index-').values_list('id', flat=True))
+        Post.objects.bulk_create(
+            [Post(text='post %s' % i, author_id=random.choice(users),
+                  group_id=random.choice(groups + [None]))
+             for i in range(posts)], batch_size=500)
+        post_ids = list(Post.objects.values_list('id', flat=True))
+        Comment.objects.bulk_create(
+            [Comment(post_id=random.choice(post_ids),
+                     author_id=random.choice(users), text='comment')
+             for _ in range(posts * 2)], batch_size=500)
+        Follow.objects.bulk_create(
+            [Follow(user_id=user, author_id=author)
+             for user in users for author in random.sample(users, 2)
+             if user != author], batch_size=500, ignore_conflicts=True)
+
+    def hot_queries(self):
+        post = Post.objects.order_by('-id').first()
+        author_id = post.author_id if post else 0
+        group_id = (Post.objects.exclude(group=None)
+                    .values_list('group_id', flat=True).first())
+        return {
+            'index': Post.objects.order_by('-pub_date', '-id')[:10],
+            'profile': Post.objects.filter(
+                author_id=author_id).order_by('-pub_date', '-id')[:10],
+            'group_posts': Post.objects.filter(
+                group_id=group_id).order_by('-pub_date', '-id')[:10],
+            'post_view comments': Comment.objects.filter(
+                post_id=post.id if post else 0).order_by('created', 'id'),
+        }
+
+    def explain(self, queryset, label):
+        # The label keeps the statement text distinct: SQLite reuses a
+        # cached EXPLAIN statement even after its indexes are dropped.
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN %s /* %s */' % (sql, label),
+                           params)
+            return ' | '.join(str(row[-1]) for row in cursor.fetchall())
+
+    def measure(self, queries, repeat, label):
+        results = {}
+        for name, queryset in queries.items():
+            plan = self.explain(queryset, label)
+            started = time.perf_counter()
+            for _ in range(repeat):
+                list(queryset.all())
+            results[name] = (plan, (time.perf_counter() - started) / repeat)
+        return results
+
+    def drop_indexes(self):
+        # Plain DDL: the SQLite schema editor refuses to run inside an
+        # atomic block, and DROP INDEX is rolled back with it anyway.
+        with connection.cursor() as cursor:
+            for model in (Post, Comment):
+                for index in model._meta.indexes:
+                    cursor.execute('DROP INDEX %s'
+                                   % connection.ops.quote_name(index.name))
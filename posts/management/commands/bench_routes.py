@@ -0,0 +1,175 @@
+import io
+import json
+import statistics
+import subprocess
+import time
+from urllib.parse import urlencode
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.urls import reverse
+
+from posts import api_urls, urls as posts_urls
+from posts.models import Group, Post, User
+from users import urls as users_urls
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = ('Request every route of posts/urls.py, posts/api_urls.py and '
+            'users/urls.py through the WSGI application and report '
+            'latency, queries and bytes as JSON. Run it against a '
+            'seed_bench database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20,
+                            help='Measured requests per route')
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--anonymous', action='store_true',
+                            help='Do not log in (login-only routes redirect)')
+        parser.add_argument('--output', help='Write the JSON report here')
+        parser.add_argument('--compare', metavar='REPORT',
+                            help='Print the change against an earlier report')
+
+    def handle(self, *args, **options):
+        self.application = get_wsgi_application()
+        sample = self.sample()
+        self.cookie = '' if options['anonymous'] else self.login_cookie()
+        report = {
+            'commit': self.commit(),
+            'requests': options['requests'],
+            'anonymous': options['anonymous'],
+            'routes': {},
+        }
+        for name, path in self.routes(sample):
+            report['routes'][name] = self.measure(
+                path, options['requests'], options['warmup'])
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w') as stream:
+                stream.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        if options['compare']:
+            self.compare(options['compare'], report)
+
+    def sample(self):
+        author = (User.objects.annotate(total=Count('posts'))
+                  .order_by('-total').first())
+        post = Post.objects.filter(author=author).order_by('-id').first()
+        group = Group.objects.annotate(
+            total=Count('posts')).order_by('-total').first()
+        if not (author and post and group):
+            raise CommandError('No data to benchmark: run seed_bench first')
+        self.author = author
+        return {
+            'username': author.username,
+            'post_id': post.id,
+            'slug': group.slug,
+        }
+
+    def routes(self, sample):
+        for module in (posts_urls, api_urls, users_urls):
+            for pattern in module.urlpatterns:
+                kwargs = {key: sample[key]
+                          for key in pattern.pattern.converters}
+                path = reverse(pattern.name, kwargs=kwargs)
+                if pattern.name == 'search':
+                    path += '?' + urlencode({'q': 'кот'})
+                yield pattern.name, path
+
+    def login_cookie(self):
+        # The most prolific author, so author-only pages render fully.
+        client = Client()
+        client.force_login(self.author)
+        session = client.cookies[settings.SESSION_COOKIE_NAME].value
+        return '%s=%s' % (settings.SESSION_COOKIE_NAME, session)
+
+    def request(self, path):
+        path, _, query = path.partition('?')
+        environ = {
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'REQUEST_METHOD': 'GET',
+            'HTTP_HOST': 'localhost',
+            'wsgi.input': io.BytesIO(),
+        }
+        if self.cookie:
+            environ['HTTP_COOKIE'] = self.cookie
+        setup_testing_defaults(environ)
+        status = []
+
+        def start_response(value, headers, exc_info=None):
+            status.append(int(value.split()[0]))
+
+        body = self.application(environ, start_response)
+        try:
+            size = sum(len(chunk) for chunk in body)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        return status[0], size
+
+    def measure(self, path, requests, warmup):
+        for _ in range(warmup):
+            self.request(path)
+        timings, queries = [], []
+        for _ in range(requests):
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                started = time.perf_counter()
+                status, size = self.request(path)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(counter.count)
+        return {
+            'path': path,
+            'status': status,
+            'p50_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(percentile(timings, 0.95), 3),
+            'queries': max(queries),
+            'bytes': size,
+        }
+
+    def commit(self):
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=settings.BASE_DIR, stderr=subprocess.DEVNULL,
+            ).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def compare(self, path, report):
+        with open(path) as stream:
+            baseline = json.load(stream)
+        self.stderr.write('%-18s %12s %12s %10s' % (
+            'route', 'p50 change', 'p95 change', 'queries'))
+        for name, current in report['routes'].items():
+            previous = baseline['routes'].get(name)
+            if not previous:
+                continue
+            self.stderr.write('%-18s %+11.1f%% %+11.1f%% %4s -> %-4s' % (
+                name,
+                (current['p50_ms'] / previous['p50_ms'] - 1) * 100,
+                (current['p95_ms'] / previous['p95_ms'] - 1) * 100,
+                previous['queries'], current['queries']))
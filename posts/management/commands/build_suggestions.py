@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import suggestions
+
+
+class Command(BaseCommand):
+    help = ('Recompute "who to follow" suggestions for every user from the '
+            'follow graph and recent posting activity')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=suggestions.TOP,
+                            help='Suggestions stored per user')
+        parser.add_argument('--days', type=int, default=30,
+                            help='Window of posting activity that counts')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        written = suggestions.build(top=options['top'], days=options['days'])
+        self.stdout.write(self.style.SUCCESS(
+            'Suggestions built: %s rows in %.1f s'
+            % (written, time.perf_counter() - started)))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from posts import trending
+
+
+class Command(BaseCommand):
+    help = ('Drop decayed and surplus rows from the trending table; run it '
+            'periodically, e.g. hourly from cron')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Recompute every score from recent comments')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            rows = trending.rebuild()
+            self.stdout.write(self.style.SUCCESS(
+                'Trending rebuilt: %s posts' % rows))
+        else:
+            deleted = trending.compact()
+            self.stdout.write(self.style.SUCCESS(
+                'Trending compacted: %s rows deleted' % deleted))
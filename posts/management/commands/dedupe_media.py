@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from posts import media
+
+
+class Command(BaseCommand):
+    help = ('Store every post image under MEDIA_ROOT once, at its content '
+            'address: duplicates are deleted along with their thumbnails, '
+            'their posts point at the kept copy and the reference counts '
+            'are rebuilt')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report duplicates without changing anything')
+
+    def handle(self, *args, **options):
+        files, duplicates, reclaimed = media.dedupe(
+            dry_run=options['dry_run'])
+        verb = 'would be removed' if options['dry_run'] else 'removed'
+        self.stdout.write(self.style.SUCCESS(
+            'Media scanned: %s files, %s duplicates %s, %s reclaimed'
+            % (files, duplicates, verb, filesizeformat(reclaimed))))
@@ -0,0 +1,35 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import export
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = ("Stream a user's posts and comments as NDJSON or CSV, "
+            'optionally zipped together with their images.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--format', choices=export.FORMATS,
+                            default='ndjson')
+        parser.add_argument('--images', action='store_true',
+                            help='Write a zip archive including images')
+        parser.add_argument('--output', help='File to write (default: stdout)')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['username']).first()
+        if user is None:
+            raise CommandError('No user %r' % options['username'])
+        chunks = export.chunks(user, options['format'], options['images'])
+        if options['output']:
+            with open(options['output'], 'wb') as stream:
+                self.write(chunks, stream)
+        else:
+            self.write(chunks, sys.stdout.buffer)
+
+    def write(self, chunks, stream):
+        for chunk in chunks:
+            stream.write(chunk)
+        stream.flush()
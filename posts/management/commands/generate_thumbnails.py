@@ -0,0 +1,49 @@
+import os
+from multiprocessing import Pool
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts import thumbnails
+from posts.models import Post
+
+
+def _init_worker():
+    django.setup()
+
+
+def _generate(task):
+    name, force = task
+    try:
+        thumbnails.generate(name, force=force)
+    except Exception as error:
+        return name, error
+    return name, None
+
+
+class Command(BaseCommand):
+    help = 'Pre-generate feed thumbnails for every post image'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Worker processes (default: CPU count)')
+        parser.add_argument('--force', action='store_true',
+                            help='Re-render thumbnails that already exist')
+
+    def handle(self, *args, **options):
+        names = (Post.objects.exclude(image='').exclude(image=None)
+                 .order_by().values_list('image', flat=True).distinct())
+        tasks = [(name, options['force']) for name in names.iterator()]
+        # Forked workers must not share the parent's database connection.
+        connections.close_all()
+        failed = 0
+        with Pool(options['workers'], initializer=_init_worker) as pool:
+            for name, error in pool.imap_unordered(_generate, tasks,
+                                                   chunksize=8):
+                if error is not None:
+                    failed += 1
+                    self.stderr.write('%s: %s' % (name, error))
+        self.stdout.write(self.style.SUCCESS(
+            'Thumbnails generated for %s images, %s failed'
+            % (len(tasks) - failed, failed)))
@@ -0,0 +1,42 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from posts.importer import TYPES, Importer
+
+
+class Command(BaseCommand):
+    help = ('Bulk-import groups, posts, comments and follows from NDJSON '
+            '(see posts.importer for the format). Existing rows are '
+            'skipped, so an import can be safely re-run.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="NDJSON file, or '-' for stdin")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Rows per bulk insert and transaction')
+        parser.add_argument('--create-users', action='store_true',
+                            help='Create unknown authors (without a '
+                                 'usable password) instead of skipping')
+        parser.add_argument('--author',
+                            help='Author of rows that name none, e.g. '
+                                 'when importing export_content output')
+
+    def handle(self, *args, **options):
+        importer = Importer(batch_size=options['batch_size'],
+                            create_users=options['create_users'],
+                            default_author=options['author'])
+        if options['path'] == '-':
+            importer.run(sys.stdin)
+        else:
+            with open(options['path'], encoding='utf-8') as stream:
+                importer.run(stream)
+        for number, message in importer.errors[:20]:
+            self.stderr.write('line %s: %s' % (number, message))
+        if len(importer.errors) > 20:
+            self.stderr.write('... and %s more'
+                              % (len(importer.errors) - 20))
+        for kind in ('user',) + TYPES:
+            self.stdout.write('%-8s created %7s  skipped %7s' % (
+                kind, importer.created[kind], importer.skipped[kind]))
+        self.stdout.write(self.style.SUCCESS(
+            '%s rows in %.0f rows/s' % (importer.rows, importer.rate())))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import timeline
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized follow feed from Follow and Post'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*',
+                            help='Only rebuild these users (default: all)')
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['usernames']:
+            users = User.objects.filter(username__in=options['usernames'])
+            user_ids = list(users.values_list('id', flat=True))
+            if len(user_ids) != len(set(options['usernames'])):
+                raise CommandError('Unknown username in %s'
+                                   % ', '.join(options['usernames']))
+        written = timeline.rebuild(user_ids)
+        self.stdout.write(self.style.SUCCESS(
+            'Timeline rebuilt: %s entries' % written))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = 'Recount follower, following and post counters for every user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report drift without writing')
+
+    def handle(self, *args, **options):
+        repaired = counters.reconcile(batch_size=options['batch_size'],
+                                      dry_run=options['dry_run'])
+        verb = 'would be repaired' if options['dry_run'] else 'repaired'
+        self.stdout.write(self.style.SUCCESS(
+            'Counters %s for %s users' % (verb, repaired)))
@@ -0,0 +1,158 @@
+import datetime
+import random
+from io import BytesIO
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from posts import counters, media, search, timeline, trending
+from posts.models import Comment, Follow, Group, Post, User
+
+PREFIX = 'bench_'
+# SQLite caps a compound SELECT (used for multi-row INSERT) at 500 rows.
+BATCH_SIZE = 500
+
+
+def zipf_weights(count, exponent):
+    """Weights for ``count`` items where rank r gets 1 / r**exponent."""
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+class Command(BaseCommand):
+    help = ('Bulk-create a production-like dataset: a few celebrity '
+            'authors and long-tail groups, with follows, comments and '
+            'images. Derived tables are rebuilt afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts', type=int, default=20000)
+        parser.add_argument('--groups', type=int, default=50)
+        parser.add_argument('--comments', type=int, default=40000)
+        parser.add_argument('--follows-per-user', type=int, default=20)
+        parser.add_argument('--images', type=int, default=20,
+                            help='Distinct image files to generate')
+        parser.add_argument('--image-ratio', type=float, default=0.3,
+                            help='Share of posts that carry an image')
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Zipf exponent for author/group popularity')
+        parser.add_argument('--days', type=int, default=365,
+                            help='Spread publication dates over this span')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        with transaction.atomic():
+            users = self.create_users(options['users'])
+            groups = self.create_groups(options['groups'])
+            images = self.create_images(options['images'])
+            posts = self.create_posts(options, users, groups, images)
+            self.create_comments(options['comments'], users, posts,
+                                 options['skew'])
+            self.create_follows(options['follows_per_user'],
+                                users, options['skew'])
+            self.stdout.write('Rebuilding timelines, counters, image '
+                              'references, trending and search')
+            timeline.rebuild()
+            counters.reconcile()
+            media.recount()
+            trending.rebuild()
+        if search.enabled():
+            search.rebuild()
+        # Rows were written without signals: drop every cached fragment.
+        cache.clear()
+        self.stdout.write(self.style.SUCCESS(
+            'Seeded %s users, %s groups, %s posts'
+            % (len(users), len(groups), len(posts))))
+
+    def create_users(self, count):
+        start = User.objects.filter(username__startswith=PREFIX).count()
+        password = make_password('bench-password')
+        User.objects.bulk_create(
+            [User(username='%s%s' % (PREFIX, start + i), password=password)
+             for i in range(count)], batch_size=BATCH_SIZE)
+        # SQLite does not return primary keys from bulk_create.
+        return list(User.objects.filter(username__startswith=PREFIX)
+                    .order_by('id').values_list('id', flat=True))
+
+    def create_groups(self, count):
+        start = Group.objects.filter(slug__startswith=PREFIX).count()
+        Group.objects.bulk_create(
+            [Group(title='Сообщество %s' % (start + i),
+                   slug='%s%s' % (PREFIX, start + i), description='')
+             for i in range(count)], batch_size=BATCH_SIZE)
+        return list(Group.objects.filter(slug__startswith=PREFIX)
+                    .order_by('id').values_list('id', flat=True))
+
+    def create_images(self, count):
+        names = []
+        for i in range(count):
+            buffer = BytesIO()
+            color = tuple(self.random.randrange(256) for _ in range(3))
+            Image.new('RGB', (1200, 800), color).save(buffer, format='JPEG')
+            names.append(default_storage.save(
+                'posts/%simage_%s.jpg' % (PREFIX, i),
+                ContentFile(buffer.getvalue())))
+        return names
+
+    def create_posts(self, options, users, groups, images):
+        author_weights = zipf_weights(len(users), options['skew'])
+        group_weights = zipf_weights(len(groups), options['skew'])
+        authors = self.random.choices(users, author_weights,
+                                      k=options['posts'])
+        words = ('пост', 'новости', 'сегодня', 'город', 'фото', 'кот',
+                 'погода', 'книга', 'музыка', 'работа', 'отпуск', 'еда')
+        start = Post.objects.order_by('-id').values_list(
+            'id', flat=True).first() or 0
+        posts = []
+        for author in authors:
+            group = None
+            if groups and self.random.random() < 0.6:
+                group = self.random.choices(groups, group_weights)[0]
+            image = None
+            if images and self.random.random() < options['image_ratio']:
+                image = self.random.choice(images)
+            text = ' '.join(self.random.choices(
+                words, k=self.random.randint(5, 60)))
+            posts.append(Post(text=text, author_id=author, group_id=group,
+                              image=image))
+        Post.objects.bulk_create(posts, batch_size=BATCH_SIZE)
+
+        # auto_now_add stamps every row with "now": spread them out.
+        created = list(Post.objects.filter(id__gt=start).order_by('id'))
+        now = timezone.now()
+        span = datetime.timedelta(days=options['days']).total_seconds()
+        offsets = sorted((self.random.random() * span for _ in created),
+                         reverse=True)
+        for post, offset in zip(created, offsets):
+            post.pub_date = now - datetime.timedelta(seconds=offset)
+        Post.objects.bulk_update(created, ['pub_date'],
+                                 batch_size=BATCH_SIZE)
+        return [post.id for post in created]
+
+    def create_comments(self, count, users, posts, skew):
+        if not posts:
+            return
+        # Recent posts draw most of the discussion.
+        weights = zipf_weights(len(posts), skew)[::-1]
+        targets = self.random.choices(posts, weights, k=count)
+        Comment.objects.bulk_create(
+            [Comment(post_id=post, author_id=self.random.choice(users),
+                     text='комментарий')
+             for post in targets], batch_size=BATCH_SIZE)
+
+    def create_follows(self, per_user, users, skew):
+        weights = zipf_weights(len(users), skew)
+        follows = []
+        for user in users:
+            for author in set(self.random.choices(users, weights,
+                                                  k=per_user)):
+                if author != user:
+                    follows.append(Follow(user_id=user, author_id=author))
+        Follow.objects.bulk_create(follows, batch_size=BATCH_SIZE,
+                                   ignore_conflicts=True)
@@ -0,0 +1,187 @@
+"""Content-addressed storage of post images.
+
+Files saved under ``PREFIX`` (``Post.image``'s ``upload_to``) are
+hashed in the same pass that writes them to disk and stored as
+``posts/<aa>/<sha256><ext>``, so the same picture uploaded twice is one
+file. sorl keys thumbnails by the source name, so every copy shares its
+thumbnails too. Other files (the thumbnails themselves) are stored as
+usual.
+
+``StoredImage`` counts the posts that use each file; posts.signals
+keeps it current, bulk writers (the importer, seed_bench) count their
+rows themselves, and the file and its thumbnails are deleted when the
+last post lets go. ``dedupe_media`` moves files stored before this into
+place and rebuilds the counts.
+"""
+import hashlib
+import os
+import uuid
+from collections import defaultdict
+
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from . import caching
+from .models import Post, StoredImage
+
+PREFIX = 'posts/'
+BATCH_SIZE = 500
+CHUNK_SIZE = 64 * 1024
+
+
+def content_name(digest, name):
+    """Where the file with sha256 ``digest``, uploaded as ``name``, lives."""
+    extension = os.path.splitext(name)[1].lower()
+    return '%s%s/%s%s' % (PREFIX, digest[:2], digest, extension)
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as stream:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def _save(self, name, content):
+        if not name.startswith(PREFIX):
+            return super()._save(name, content)
+        directory = self.path(PREFIX)
+        os.makedirs(directory, exist_ok=True)
+        # Dot files are skipped by dedupe_media.
+        temporary = os.path.join(directory, '.upload-%s' % uuid.uuid4().hex)
+        digest = hashlib.sha256()
+        try:
+            fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_EXCL
+                         | getattr(os, 'O_BINARY', 0), 0o666)
+            with os.fdopen(fd, 'wb') as stream:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    stream.write(chunk)
+            name = content_name(digest.hexdigest(), name)
+            path = self.path(name)
+            if os.path.exists(path):
+                os.remove(temporary)  # stored already
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temporary, path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(path, self.file_permissions_mode)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return name
+
+
+def _counted(name):
+    return bool(name) and name.startswith(PREFIX)
+
+
+def acquire(name, count=1):
+    """Count ``count`` more posts using ``name``."""
+    if not _counted(name):
+        return
+    images = StoredImage.objects.filter(name=name)
+    if images.update(refs=F('refs') + count):
+        return
+    StoredImage.objects.bulk_create([StoredImage(name=name)],
+                                    ignore_conflicts=True)
+    images.update(refs=F('refs') + count)
+
+
+def release(name):
+    """Count one post less using ``name``; the last one deletes the file."""
+    if not _counted(name):
+        return
+    StoredImage.objects.filter(name=name, refs__gt=0).update(
+        refs=F('refs') - 1)
+    deleted, _ = StoredImage.objects.filter(name=name, refs=0).delete()
+    if deleted:
+        transaction.on_commit(lambda: _remove(name))
+
+
+def _remove(name):
+    # Uploaded again meanwhile, or used by rows written without signals
+    # (loaddata, say) that were never counted.
+    if (StoredImage.objects.filter(name=name).exists()
+            or Post.objects.filter(image=name).exists()):
+        return
+    remove_file(name)
+
+
+def remove_file(name):
+    """Delete ``name`` and every thumbnail rendered from it."""
+    default.kvstore.delete_thumbnails(ImageFile(name))
+    default_storage.delete(name)
+
+
+def recount():
+    """Rebuild every count from the posts; returns how many files are used."""
+    counts = Post.objects.filter(image__startswith=PREFIX).order_by().values(
+        'image').annotate(refs=Count('id')).values_list('image', 'refs')
+    with transaction.atomic():
+        StoredImage.objects.all().delete()
+        StoredImage.objects.bulk_create(
+            [StoredImage(name=name, refs=refs) for name, refs in counts],
+            batch_size=BATCH_SIZE)
+        return StoredImage.objects.count()
+
+
+def _stored_files():
+    """Every file under ``PREFIX`` as ``(name, path)``."""
+    root = default_storage.path('')
+    for directory, _, filenames in os.walk(default_storage.path(PREFIX)):
+        for filename in sorted(filenames):
+            if filename.startswith('.'):  # an upload in progress
+                continue
+            path = os.path.join(directory, filename)
+            yield os.path.relpath(path, root).replace(os.sep, '/'), path
+
+
+def dedupe(dry_run=False):
+    """Move every stored image to its content address, pointing posts at
+    the kept copy; returns ``(files, duplicates, bytes reclaimed)``."""
+    copies = defaultdict(list)
+    sizes = {}
+    for name, path in _stored_files():
+        digest = file_digest(path)
+        copies[digest].append(name)
+        sizes[digest] = os.path.getsize(path)
+    duplicates = reclaimed = 0
+    for digest, names in copies.items():
+        duplicates += len(names) - 1
+        reclaimed += sizes[digest] * (len(names) - 1)
+        addresses = {content_name(digest, name) for name in names}
+        kept = [name for name in names if name in addresses]
+        target = kept[0] if kept else min(addresses)
+        if names != [target] and not dry_run:
+            _collapse(target, names)
+    if not dry_run:
+        recount()
+    return sum(map(len, copies.values())), duplicates, reclaimed
+
+
+def _collapse(target, names):
+    if target not in names:
+        # A hard link: posts keep a valid file until they are moved over.
+        path = default_storage.path(target)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.link(default_storage.path(names[0]), path)
+    moved = [name for name in names if name != target]
+    with transaction.atomic():
+        posts = Post.objects.filter(image__in=moved)
+        scopes = set()
+        for post in posts.only('author_id', 'group_id'):
+            scopes.update(caching.scopes_for_post(post))
+        # A new updated stamp expires the cached cards that show the image.
+        posts.update(image=target, updated=timezone.now())
+    caching.bump(scopes)
+    for name in moved:
+        remove_file(name)
@@ -0,0 +1,263 @@
+"""Per-view request metrics in Prometheus text format.
+
+``MetricsMiddleware`` measures every request and files it under the
+resolved URL name: wall time, SQL query count and time, template render
+time and cache hits/misses. The numbers are kept in in-process
+histograms (one set per worker process, as with any Prometheus client
+without a shared store) and served by ``metrics_view``. Requests slower
+than ``POSTS_SLOW_REQUEST_SECONDS`` are logged with their SQL.
+
+Template time comes from the ``DjangoTemplates`` backend below and
+cache lookups from ``posts.cache_backends``; both report to whatever
+request is current on the thread.
+"""
+import hmac
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends import django as django_backend
+
+logger = logging.getLogger('posts.slow')
+
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNTS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+_current = threading.local()
+
+
+class Histogram:
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.series = defaultdict(lambda: [[0] * len(buckets), 0, 0])
+        self.lock = threading.Lock()
+
+    def observe(self, view, value):
+        with self.lock:
+            counts, _, _ = series = self.series[view]
+            index = bisect_left(self.buckets, value)
+            if index < len(counts):
+                counts[index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        yield '# HELP %s %s' % (self.name, self.documentation)
+        yield '# TYPE %s histogram' % self.name
+        with self.lock:
+            series = sorted((view, list(counts), total, count)
+                            for view, (counts, total, count)
+                            in self.series.items())
+        for view, counts, total, count in series:
+            cumulative = 0
+            for bound, observed in zip(self.buckets, counts):
+                cumulative += observed
+                yield '%s_bucket{view="%s",le="%s"} %s' % (
+                    self.name, view, bound, cumulative)
+            yield '%s_bucket{view="%s",le="+Inf"} %s' % (
+                self.name, view, count)
+            yield '%s_sum{view="%s"} %s' % (self.name, view, round(total, 6))
+            yield '%s_count{view="%s"} %s' % (self.name, view, count)
+
+
+class Counter:
+
+    def __init__(self, name, documentation, label):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.series = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def inc(self, view, value, amount=1):
+        with self.lock:
+            self.series[(view, value)] += amount
+
+    def render(self):
+        yield '# HELP %s %s' % (self.name, self.documentation)
+        yield '# TYPE %s counter' % self.name
+        with self.lock:
+            series = sorted(self.series.items())
+        for (view, value), total in series:
+            yield '%s{view="%s",%s="%s"} %s' % (
+                self.name, view, self.label, value, total)
+
+
+REQUEST_SECONDS = Histogram(
+    'yatube_request_duration_seconds', 'Wall time of a request.', SECONDS)
+SQL_QUERIES = Histogram(
+    'yatube_sql_queries', 'SQL queries run by a request.', COUNTS)
+SQL_SECONDS = Histogram(
+    'yatube_sql_duration_seconds', 'Time a request spent in SQL.', SECONDS)
+TEMPLATE_SECONDS = Histogram(
+    'yatube_template_render_seconds', 'Time a request spent rendering.',
+    SECONDS)
+RESPONSES = Counter(
+    'yatube_responses_total', 'Responses by status code.', 'status')
+CACHE_LOOKUPS = Counter(
+    'yatube_cache_lookups_total', 'Cache keys looked up by a request.',
+    'result')
+
+METRICS = (REQUEST_SECONDS, SQL_QUERIES, SQL_SECONDS, TEMPLATE_SECONDS,
+           RESPONSES, CACHE_LOOKUPS)
+
+
+class RequestStats:
+
+    def __init__(self, capture_sql):
+        self.capture_sql = capture_sql
+        self.queries = 0
+        self.sql_seconds = 0
+        self.statements = []
+        self.template_seconds = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.sql_seconds += elapsed
+            if self.capture_sql:
+                self.statements.append((elapsed, sql, params))
+
+
+def record_cache(hits, misses):
+    stats = getattr(_current, 'stats', None)
+    if stats is not None:
+        stats.cache_hits += hits
+        stats.cache_misses += misses
+
+
+def _record_template(seconds):
+    stats = getattr(_current, 'stats', None)
+    if stats is not None:
+        stats.template_seconds += seconds
+
+
+class TimedTemplate:
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        # Templates rendered from within a render are already timed.
+        depth = getattr(_current, 'depth', 0)
+        _current.depth = depth + 1
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            _current.depth = depth
+            if not depth:
+                _record_template(time.perf_counter() - started)
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """The stock backend, timing each top-level render."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name or 'unnamed'
+
+
+class MetricsMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        threshold = getattr(settings, 'POSTS_SLOW_REQUEST_SECONDS', None)
+        stats = RequestStats(capture_sql=threshold is not None)
+        _current.stats = stats
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats))
+                response = self.get_response(request)
+        finally:
+            _current.stats = None
+        elapsed = time.perf_counter() - started
+
+        view = _view_name(request)
+        REQUEST_SECONDS.observe(view, elapsed)
+        SQL_QUERIES.observe(view, stats.queries)
+        SQL_SECONDS.observe(view, stats.sql_seconds)
+        TEMPLATE_SECONDS.observe(view, stats.template_seconds)
+        RESPONSES.inc(view, response.status_code)
+        if stats.cache_hits:
+            CACHE_LOOKUPS.inc(view, 'hit', stats.cache_hits)
+        if stats.cache_misses:
+            CACHE_LOOKUPS.inc(view, 'miss', stats.cache_misses)
+        if threshold is not None and elapsed >= threshold:
+            self.log_slow(request, view, elapsed, stats)
+        return response
+
+    def log_slow(self, request, view, elapsed, stats):
+        lines = ['%8.2f ms  %s  %r' % (seconds * 1000, sql, params)
+                 for seconds, sql, params in stats.statements]
+        logger.warning(
+            'Slow request %s %s (%s): %.1f ms, %s queries in %.1f ms, '
+            'templates %.1f ms\n%s',
+            request.method, request.get_full_path(), view, elapsed * 1000,
+            stats.queries, stats.sql_seconds * 1000,
+            stats.template_seconds * 1000, '\n'.join(lines))
+
+
+def _cache_tier_lines():
+    name = 'yatube_cache_tier_lookups_total'
+    yield '# HELP %s Lookups per tier of two-tier caches.' % name
+    yield '# TYPE %s counter' % name
+    for alias in settings.CACHES:
+        stats = getattr(caches[alias], 'stats', None)
+        if stats is None:
+            continue
+        for tier, counts in sorted(stats().items()):
+            for result, total in sorted(counts.items()):
+                yield '%s{cache="%s",tier="%s",result="%s"} %s' % (
+                    name, alias, tier, result, total)
+
+
+def _authorized(request):
+    # Not by address: behind a local proxy every request is 127.0.0.1.
+    if request.user.is_staff:
+        return True
+    token = settings.POSTS_METRICS_TOKEN
+    given = request.META.get('HTTP_AUTHORIZATION', '')
+    return bool(token) and hmac.compare_digest(given, 'Bearer %s' % token)
+
+
+def metrics_view(request):
+    """Prometheus text exposition; staff or the scraper's token only."""
+    if not _authorized(request):
+        return HttpResponseForbidden()
+    lines = [line for metric in METRICS for line in metric.render()]
+    lines.extend(_cache_tier_lines())
+    return HttpResponse('\n'.join(lines) + '\n',
+                        content_type='text/plain; version=0.0.4')
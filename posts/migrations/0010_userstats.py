@@ -0,0 +1,45 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:56
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_user_stats(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Follow = apps.get_model('posts', 'Follow')
+    Post = apps.get_model('posts', 'Post')
+    UserStats = apps.get_model('posts', 'UserStats')
+    counts = {}
+    for name, model, field in (('followers', Follow, 'author'),
+                               ('following', Follow, 'user'),
+                               ('posts', Post, 'author')):
+        rows = model.objects.values_list(field).annotate(
+            total=models.Count('id')).order_by()
+        for user_id, total in rows:
+            counts.setdefault(user_id, {})[name] = total
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=user_id, **counts.get(user_id, {}))
+         for user_id in User.objects.values_list('id', flat=True)],
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0009_timelineentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('followers', models.PositiveIntegerField(default=0)),
+                ('following', models.PositiveIntegerField(default=0)),
+                ('posts', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_user_stats, migrations.RunPython.noop),
+    ]
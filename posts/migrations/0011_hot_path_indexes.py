@@ -0,0 +1,52 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:57
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicate_follows(apps, schema_editor):
+    Follow = apps.get_model('posts', 'Follow')
+    UserStats = apps.get_model('posts', 'UserStats')
+    first_ids = Follow.objects.values('user', 'author').annotate(
+        first_id=models.Min('id')).values('first_id')
+    deleted, _ = Follow.objects.exclude(id__in=first_ids).delete()
+    if not deleted:
+        return
+    # The duplicates were counted: recount what they inflated.
+    for counter, field in (('followers', 'author'), ('following', 'user')):
+        totals = Follow.objects.filter(**{field: OuterRef('user')}).order_by(
+        ).values(field).annotate(total=models.Count('id')).values('total')
+        UserStats.objects.update(**{counter: Coalesce(Subquery(totals), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_userstats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'created', 'id'], name='comment_post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-pub_date', '-id'], name='post_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', '-pub_date', '-id'], name='post_author_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['group', '-pub_date', '-id'], name='post_group_pub_date_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_follows,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('user', 'author'), name='unique_follow'),
+        ),
+    ]
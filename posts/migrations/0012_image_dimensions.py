@@ -0,0 +1,20 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:01
+
+import django.core.validators
+from django.db import migrations, models
+import posts.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, upload_to='posts/', validators=[django.core.validators.validate_image_file_extension, posts.validators.validate_file_size, posts.validators.validate_image_dimensions]),
+        ),
+    ]
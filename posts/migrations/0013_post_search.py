@@ -0,0 +1,38 @@
+from django.db import migrations
+
+# Frozen copies of posts.search as of this migration; later changes to
+# that module must not change what this migration does.
+CREATE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_post_search USING fts5("
+    "text, group_title, tokenize = 'unicode61 remove_diacritics 2')"
+)
+FILL_SQL = (
+    "INSERT INTO posts_post_search (rowid, text, group_title) "
+    "SELECT p.id, p.text, COALESCE(g.title, '') FROM posts_post p "
+    "LEFT JOIN posts_group g ON g.id = p.group_id"
+)
+DROP_SQL = 'DROP TABLE IF EXISTS posts_post_search'
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_SQL)
+    schema_editor.execute(FILL_SQL)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(DROP_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_image_dimensions'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.utils.timezone
+
+
+def set_updated(apps, schema_editor):
+    # Last activity so far: the newest comment, else publication.
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    latest_comment = Comment.objects.filter(
+        post=OuterRef('pk')).order_by('-created').values('created')[:1]
+    Post.objects.update(
+        updated=Coalesce(Subquery(latest_comment), F('pub_date')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_post_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='date updated'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(set_updated, migrations.RunPython.noop),
+    ]
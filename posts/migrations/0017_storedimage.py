@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:43
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_references(apps, schema_editor):
+    # Images uploaded so far, one reference per post (see posts.media).
+    Post = apps.get_model('posts', 'Post')
+    StoredImage = apps.get_model('posts', 'StoredImage')
+    counts = Post.objects.filter(image__startswith='posts/').order_by(
+    ).values('image').annotate(refs=Count('id')).values_list('image', 'refs')
+    StoredImage.objects.bulk_create(
+        [StoredImage(name=name, refs=refs) for name, refs in counts],
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_trendingscore'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredImage',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('refs', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
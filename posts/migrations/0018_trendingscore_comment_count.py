@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:55
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+
+
+def count_comments(apps, schema_editor):
+    TrendingScore = apps.get_model('posts', 'TrendingScore')
+    Comment = apps.get_model('posts', 'Comment')
+    TrendingScore.objects.update(comment_count=Subquery(
+        Comment.objects.filter(post=OuterRef('post')).order_by().values(
+            'post').annotate(total=Count('id')).values('total')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0017_storedimage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trendingscore',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_comments, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,9 @@
 from django.contrib.auth import get_user_model
 from django.core.validators import validate_image_file_extension
 from django.db import models
+from django.db.models.functions import Coalesce
 
-from .validators import validate_file_size
+from .validators import validate_file_size, validate_image_dimensions
 
 User = get_user_model()
 
@@ -16,17 +17,66 @@ class Group(models.Model):
         return self.title
 
 
+def comment_count(post='pk'):
+    """The comments of the post at ``post``, as a correlated subquery.
+
+    Unlike ``Count('comments')`` it needs no GROUP BY over the whole feed,
+    so a page is read straight off the pub_date indexes.
+    """
+    comments = Comment.objects.filter(post=models.OuterRef(post)).order_by(
+    ).values('post').annotate(total=models.Count('id')).values('total')
+    return Coalesce(
+        models.Subquery(comments, output_field=models.IntegerField()), 0)
+
+
+class FeedQuerySet(models.QuerySet):
+
+    def count(self):
+        # The comment count does not change how many rows match; left in,
+        # it would be computed (and grouped by) for every one of them.
+        if (self._result_cache is None
+                and 'comment_count' in self.query.annotations):
+            clone = self._chain()
+            names = set(clone.query.annotation_select) - {'comment_count'}
+            del clone.query.annotations['comment_count']
+            clone.query.set_annotation_mask(names)
+            return clone.count()
+        return super().count()
+
+
+class PostQuerySet(FeedQuerySet):
+
+    def for_feed(self):
+        """Everything a post card renders, fetched in a single query."""
+        return self.select_related('author', 'group').annotate(
+            comment_count=comment_count()
+        ).order_by('-pub_date', '-id')
+
+
 class Post(models.Model):
 
+    objects = PostQuerySet.as_manager()
+
     def __str__(self):
         return self.text
 
     class Meta:
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='post_pub_date_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_pub_date_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_pub_date_idx'),
+        ]
 
     text = models.TextField()
     pub_date = models.DateTimeField('date published',
                                     auto_now_add=True)
+    # Also touched when a comment is added or removed: the comment count
+    # is part of every rendered card.
+    updated = models.DateTimeField('date updated', auto_now=True)
     author = models.ForeignKey(User,
                                on_delete=models.CASCADE,
                                related_name="posts")
@@ -37,7 +87,8 @@ class Post(models.Model):
     image = models.ImageField(upload_to='posts/',
                               validators=[
                                   validate_image_file_extension,
-                                  validate_file_size],
+                                  validate_file_size,
+                                  validate_image_dimensions],
                               blank=True, null=True)
 
 
@@ -53,6 +104,12 @@ class Comment(models.Model):
     created = models.DateTimeField('date published',
                                    auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'created', 'id'],
+                         name='comment_post_created_idx'),
+        ]
+
 
 class Follow(models.Model):
 
@@ -62,3 +119,96 @@ class Follow(models.Model):
     author = models.ForeignKey(User,
                                on_delete=models.CASCADE,
                                related_name="following")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'author'],
+                                    name='unique_follow'),
+        ]
+
+
+class TimelineEntry(models.Model):
+    """Materialized follow feed: one row per post per follower."""
+
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name="timeline")
+    post = models.ForeignKey(Post,
+                             on_delete=models.CASCADE,
+                             related_name="timeline_entries")
+    author = models.ForeignKey(User,
+                               on_delete=models.CASCADE,
+                               related_name="+")
+    pub_date = models.DateTimeField()
+
+    objects = FeedQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('-pub_date', '-id')
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'],
+                                    name='unique_timeline_post'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-id'],
+                         name='timeline_user_pub_date_idx'),
+            models.Index(fields=['user', 'author'],
+                         name='timeline_user_author_idx'),
+        ]
+
+
+class UserStats(models.Model):
+    """Denormalized profile counters, kept current by posts.signals."""
+
+    user = models.OneToOneField(User,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name="stats")
+    followers = models.PositiveIntegerField(default=0)
+    following = models.PositiveIntegerField(default=0)
+    posts = models.PositiveIntegerField(default=0)
+
+
+class Suggestion(models.Model):
+    """Precomputed "who to follow" entry, written by build_suggestions."""
+
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name="suggestions")
+    author = models.ForeignKey(User,
+                               on_delete=models.CASCADE,
+                               related_name="+")
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ('user', 'rank')
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'rank'],
+                                    name='unique_suggestion_rank'),
+        ]
+
+
+class TrendingScore(models.Model):
+    """Time-decayed comment velocity of a post, kept by posts.trending."""
+
+    post = models.OneToOneField(Post,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name="trending")
+    score = models.FloatField()
+    # All comments of the post, so the feed need not count them.
+    comment_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score', '-post'],
+                         name='trending_score_idx'),
+        ]
+
+
+class StoredImage(models.Model):
+    """How many posts use an image file, kept by posts.media."""
+
+    name = models.CharField(max_length=100, primary_key=True)
+    refs = models.PositiveIntegerField(default=0)
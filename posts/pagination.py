@@ -0,0 +1,157 @@
+import base64
+import binascii
+import datetime
+import json
+from collections.abc import Sequence
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+PAGE_SIZE = 10
+COMMENTS_PAGE_SIZE = 20
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def _json_value(value):
+    # Full microsecond precision: DjangoJSONEncoder truncates to
+    # milliseconds, which would make the seek skip rows.
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(repr(value))
+
+
+class CursorPage(Sequence):
+
+    def __init__(self, object_list, paginator, next_cursor=None,
+                 previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<Cursor page of %s items>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Keyset pagination: seeks on ``ordering`` instead of OFFSET/COUNT.
+
+    All ordering fields must sort in the same direction, and the last one
+    must be unique (normally ``id``) so that the seek is unambiguous.
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, per_page, ordering=('-pub_date', '-id')):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.descending = ordering[0].startswith('-')
+        self.fields = [name.lstrip('-') for name in ordering]
+        self.ordering = ordering
+
+    def encode_cursor(self, obj, reverse=False):
+        if isinstance(obj, dict):  # a values() row
+            values = [obj[name] for name in self.fields]
+        else:
+            values = [getattr(obj, name) for name in self.fields]
+        raw = json.dumps({'v': values, 'r': reverse}, default=_json_value)
+        token = base64.urlsafe_b64encode(raw.encode())
+        return token.decode().rstrip('=')
+
+    def decode_cursor(self, token):
+        try:
+            padding = '=' * (-len(token) % 4)
+            raw = base64.urlsafe_b64decode(token + padding)
+            data = json.loads(raw.decode())
+            values, reverse = data['v'], bool(data['r'])
+            if len(values) != len(self.fields):
+                raise InvalidCursor(token)
+            model = self.object_list.model
+            values = [model._meta.get_field(name).to_python(value)
+                      for name, value in zip(self.fields, values)]
+        except (binascii.Error, ValueError, TypeError, KeyError,
+                AttributeError, ValidationError):
+            raise InvalidCursor(token)
+        return values, reverse
+
+    def _seek(self, values, forward):
+        # (a, b) < (x, y)  <=>  a < x OR (a = x AND b < y)
+        lookup = 'lt' if forward == self.descending else 'gt'
+        condition = Q()
+        for position, name in enumerate(self.fields):
+            clause = Q(**{f'{name}__{lookup}': values[position]})
+            for previous, value in zip(self.fields[:position], values):
+                clause &= Q(**{previous: value})
+            condition |= clause
+        return condition
+
+    def get_page(self, token=None):
+        """Return a page; a missing or malformed cursor yields the first."""
+        values, reverse = None, False
+        if token:
+            try:
+                values, reverse = self.decode_cursor(token)
+            except InvalidCursor:
+                values, reverse = None, False
+
+        queryset = self.object_list
+        if values is None:
+            queryset = queryset.order_by(*self.ordering)
+        elif reverse:
+            flipped = [name[1:] if name.startswith('-') else '-' + name
+                       for name in self.ordering]
+            queryset = queryset.filter(
+                self._seek(values, forward=False)).order_by(*flipped)
+        else:
+            queryset = queryset.filter(
+                self._seek(values, forward=True)).order_by(*self.ordering)
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = self.encode_cursor(rows[-1])
+        if rows and has_previous:
+            previous_cursor = self.encode_cursor(rows[0], reverse=True)
+        return CursorPage(rows, self, next_cursor, previous_cursor)
+
+
+def paginate(request, object_list, ordering=('-pub_date', '-id')):
+    """Paginate a feed by page number, or by cursor when one is requested.
+
+    Cursor mode is used for every request when
+    ``settings.POSTS_CURSOR_PAGINATION`` is on, otherwise only when the
+    query string carries a ``cursor`` parameter.
+    """
+    cursor_mode = getattr(settings, 'POSTS_CURSOR_PAGINATION', False)
+    if cursor_mode or 'cursor' in request.GET:
+        paginator = CursorPaginator(object_list, PAGE_SIZE, ordering)
+        return paginator, paginator.get_page(request.GET.get('cursor'))
+    paginator = Paginator(object_list, PAGE_SIZE)
+    return paginator, paginator.get_page(request.GET.get('page'))
@@ -0,0 +1,76 @@
+"""Primary/replica routing for the read-only pages.
+
+``ReplicaMiddleware`` marks GET and HEAD requests to the views in
+``READ_VIEWS`` and the router sends their reads to one of
+``POSTS_DB_REPLICAS``, picked once per request. Everything else, and
+every write, uses the primary (``default``).
+
+Replicas lag, so a client that has just written is pinned to the
+primary for ``POSTS_PRIMARY_PIN_SECONDS`` by a cookie, which works
+across workers without a session lookup: authors always see their own
+post, comment or follow.
+"""
+import random
+import threading
+import time
+
+from django.conf import settings
+
+READ_VIEWS = frozenset((
+    'index', 'group_posts', 'profile', 'post_view', 'post_comments',
+    'follow_index', 'search', 'trending',
+    'api_index', 'api_group_posts', 'api_profile', 'api_post',
+    'api_post_comments', 'api_follow_index',
+))
+# Views that write on GET (the follow buttons are plain links).
+WRITE_VIEWS = frozenset(('profile_follow', 'profile_unfollow'))
+PIN_COOKIE = 'primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = threading.local()
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        return getattr(_state, 'replica', None)
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+
+def _pinned(request):
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class ReplicaMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.replica = None
+        match = request.resolver_match
+        if (request.method not in SAFE_METHODS
+                or match is not None and match.url_name in WRITE_VIEWS):
+            seconds = settings.POSTS_PRIMARY_PIN_SECONDS
+            response.set_cookie(PIN_COOKIE, int(time.time() + seconds),
+                                max_age=seconds, httponly=True)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        replicas = settings.POSTS_DB_REPLICAS
+        if (replicas and request.method in ('GET', 'HEAD')
+                and request.resolver_match.url_name in READ_VIEWS
+                and not _pinned(request)):
+            _state.replica = random.choice(replicas)
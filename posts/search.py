@@ -0,0 +1,151 @@
+"""Full-text search over posts, backed by an SQLite FTS5 table.
+
+``posts_post_search`` holds one row per post (rowid = post id) with its
+text and group title; posts.signals keeps it in sync. Other database
+backends fall back to a plain ``icontains`` scan.
+"""
+import re
+
+from django.db import connection, connections, router
+from django.db.models.expressions import RawSQL
+
+from .models import Post
+
+TABLE = 'posts_post_search'
+
+CREATE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5("
+    "text, group_title, tokenize = 'unicode61 remove_diacritics 2')" % TABLE
+)
+FILL_SQL = (
+    'INSERT INTO %s (rowid, text, group_title) '
+    'SELECT p.id, p.text, COALESCE(g.title, \'\') FROM posts_post p '
+    'LEFT JOIN posts_group g ON g.id = p.group_id' % TABLE
+)
+DROP_SQL = 'DROP TABLE IF EXISTS %s' % TABLE
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def enabled():
+    return connection.vendor == 'sqlite'
+
+
+def build_query(text):
+    """Turn free user input into a safe FTS5 expression.
+
+    Every word becomes a quoted term (so operators and quotes in the
+    input are never interpreted), the terms are ANDed, and the last one
+    matches as a prefix for search-as-you-type.
+    """
+    words = WORD_RE.findall(text)
+    if not words:
+        return ''
+    terms = ['"%s"' % word for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def index_post(post):
+    if not enabled():
+        return
+    group_title = post.group.title if post.group_id else ''
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % TABLE, [post.pk])
+        cursor.execute(
+            'INSERT INTO %s (rowid, text, group_title) '
+            'VALUES (%%s, %%s, %%s)' % TABLE,
+            [post.pk, post.text, group_title])
+
+
+def index_posts(post_ids):
+    """Index a batch of posts that are not in the index yet."""
+    if not enabled() or not post_ids:
+        return
+    placeholders = ', '.join(['%s'] * len(post_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(FILL_SQL + ' WHERE p.id IN (%s)' % placeholders,
+                       list(post_ids))
+
+
+def remove_post(post_id):
+    if not enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % TABLE, [post_id])
+
+
+def reindex_group(group_id, title):
+    if not enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'UPDATE %s SET group_title = %%s WHERE rowid IN '
+            '(SELECT id FROM posts_post WHERE group_id = %%s)' % TABLE,
+            [title, group_id])
+
+
+def rebuild():
+    with connection.cursor() as cursor:
+        cursor.execute(DROP_SQL)
+        cursor.execute(CREATE_SQL)
+        cursor.execute(FILL_SQL)
+
+
+def filter_posts(queryset, text):
+    """Narrow ``queryset`` to posts matching ``text`` (unranked)."""
+    expression = build_query(text)
+    if not expression:
+        return queryset.none()
+    if not enabled():
+        return queryset.filter(text__icontains=text)
+    return queryset.filter(pk__in=RawSQL(
+        'SELECT rowid FROM %s WHERE %s MATCH %%s' % (TABLE, TABLE),
+        [expression]))
+
+
+def _read_connection():
+    # The database the Post rows will be read from (a replica, maybe):
+    # matches from the primary could name rows it does not have yet.
+    return connections[router.db_for_read(Post) or 'default']
+
+
+class SearchResults:
+    """Ranked, lazily fetched results, sliceable for ``Paginator``."""
+
+    def __init__(self, text):
+        self.text = text
+        self.expression = build_query(text)
+
+    def count(self):
+        if not self.expression:
+            return 0
+        if not enabled():
+            return filter_posts(Post.objects.all(), self.text).count()
+        with _read_connection().cursor() as cursor:
+            cursor.execute(
+                'SELECT count(*) FROM %s WHERE %s MATCH %%s' % (TABLE, TABLE),
+                [self.expression])
+            return cursor.fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        if not self.expression or stop is not None and stop <= start:
+            return []
+        if not enabled():
+            return list(filter_posts(Post.objects.for_feed(),
+                                     self.text)[start:stop])
+        with _read_connection().cursor() as cursor:
+            cursor.execute(
+                'SELECT rowid FROM %s WHERE %s MATCH %%s '
+                'ORDER BY rank LIMIT %%s OFFSET %%s' % (TABLE, TABLE),
+                [self.expression, -1 if stop is None else stop - start,
+                 start])
+            ids = [row[0] for row in cursor.fetchall()]
+        posts = Post.objects.for_feed().in_bulk(ids)
+        return [posts[pk] for pk in ids if pk in posts]
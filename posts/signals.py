@@ -0,0 +1,200 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import (caching, counters, entities, media, search, timeline,
+               trending)
+from .models import Comment, Follow, Group, Post, User, UserStats
+
+
+@receiver(post_save, sender=Post)
+def fan_out_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.fan_out_post(instance)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.add_author(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def trim_timeline(sender, instance, **kwargs):
+    timeline.remove_author(instance.user_id, instance.author_id)
+
+
+@receiver(pre_save, sender=Post)
+def invalidate_previous_feeds(sender, instance, raw=False, **kwargs):
+    # An edit may move the post out of its old group.
+    if instance.pk is None or raw:
+        return
+    previous = Post.objects.filter(pk=instance.pk).only(
+        'author_id', 'group_id').first()
+    if previous is not None and previous.group_id != instance.group_id:
+        caching.bump(caching.scopes_for_post(previous))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_feeds(sender, instance, **kwargs):
+    caching.bump(caching.scopes_for_post(instance))
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_feeds(sender, instance, created, raw=False,
+                            update_fields=None, **kwargs):
+    # Cards show the author's name; logins only touch last_login.
+    if created or raw or (update_fields is not None
+                          and 'username' not in update_fields):
+        return
+    caching.bump(caching.scopes_for_author(instance.pk))
+
+
+@receiver(post_save, sender=Group)
+def invalidate_group_feeds(sender, instance, created, raw=False, **kwargs):
+    # Cards show the group's title and link to its slug.
+    if not created and not raw:
+        caching.bump(caching.scopes_for_group(instance.pk))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_commented_feeds(sender, instance, **kwargs):
+    if Comment.post.is_cached(instance):
+        post = instance.post
+    else:
+        post = Post.objects.filter(pk=instance.post_id).only(
+            'author_id', 'group_id').first()
+    if post is not None:
+        caching.bump(caching.scopes_for_post(post))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def touch_commented_post(sender, instance, raw=False, **kwargs):
+    # Post.updated is the validator of conditional GETs (posts.conditional).
+    if not raw:
+        Post.objects.filter(pk=instance.post_id).update(
+            updated=timezone.now())
+
+
+@receiver(pre_save, sender=Post)
+def remember_previous_image(sender, instance, raw=False, **kwargs):
+    instance._previous_image = None
+    if instance.pk is not None and not raw:
+        instance._previous_image = Post.objects.filter(
+            pk=instance.pk).values_list('image', flat=True).first()
+
+
+@receiver(post_save, sender=Post)
+def count_image_references(sender, instance, raw=False, **kwargs):
+    # Unchanged for most edits; raw loads are counted by dedupe_media.
+    previous = getattr(instance, '_previous_image', None)
+    if not raw and (instance.image.name or None) != (previous or None):
+        media.acquire(instance.image.name)
+        media.release(previous)
+
+
+@receiver(post_delete, sender=Post)
+def release_deleted_image(sender, instance, **kwargs):
+    media.release(instance.image.name)
+
+
+@receiver(post_save, sender=Comment)
+def score_trending_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        trending.record_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_trending_comment(sender, instance, **kwargs):
+    trending.forget_comment(instance)
+
+
+@receiver(post_save, sender=User)
+def create_user_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.increment(instance.author_id, posts=1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    counters.increment(instance.author_id, posts=-1)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_viewer_pages(sender, instance, raw=False, **kwargs):
+    # The follow button and suggestions on every profile the user views.
+    if not raw:
+        caching.bump(['viewer:%s' % instance.user_id])
+
+
+@receiver(post_save, sender=Follow)
+def count_new_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.increment(instance.author_id, followers=1)
+        counters.increment(instance.user_id, following=1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    counters.increment(instance.author_id, followers=-1)
+    counters.increment(instance.user_id, following=-1)
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.remove_post(instance.pk)
+
+
+@receiver(post_save, sender=Group)
+def reindex_group(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        search.reindex_group(instance.pk, instance.title)
+
+
+@receiver(pre_delete, sender=Group)
+def unindex_group(sender, instance, **kwargs):
+    # Its posts are detached with a plain UPDATE that sends no signals.
+    search.reindex_group(instance.pk, '')
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    # WAL lets readers run alongside the writer instead of behind it.
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for name, value in settings.POSTS_SQLITE_PRAGMAS.items():
+                cursor.execute('PRAGMA %s = %s' % (name, value))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def forget_cached_group(sender, instance, **kwargs):
+    entities.groups.forget(instance)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, update_fields=None, **kwargs):
+    # Logins only touch last_login; every worker would drop its users.
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    entities.users.forget(instance)
@@ -0,0 +1,120 @@
+"""Offline "who to follow" suggestions from the follow graph.
+
+``build`` streams every follow, ordered by user, into integer-indexed
+adjacency arrays (one offsets array and one targets array, CSR style),
+then scores each author two hops away from a user: the number of the
+user's followees who follow them, plus a bonus for how much they posted
+lately. Users with fewer candidates than ``top`` are topped up with the
+most active authors. The best ``top`` per user replace the stored
+``Suggestion`` rows ``BATCH_SIZE`` users at a time, so only one batch
+of rows is held in memory; pages read them with one indexed query
+(``for_user``).
+"""
+import heapq
+import math
+from array import array
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from . import caching
+from .models import Follow, Post, Suggestion, User
+
+TOP = 10
+SHOWN = 5
+BATCH_SIZE = 500
+# A user followed by one friend outranks any amount of activity alone.
+ACTIVITY_WEIGHT = 0.1
+
+
+def load_graph():
+    """``(ids, offsets, targets)``: followees of ``ids[i]`` are
+    ``targets[offsets[i]:offsets[i + 1]]``, as indices into ``ids``."""
+    ids = array('i', User.objects.order_by('id').values_list('id', flat=True))
+    index = {pk: i for i, pk in enumerate(ids)}
+    offsets, targets = array('i', [0]), array('i')
+    # Follows come in the order of ``ids`` (by user, then author), so
+    # each user's row is complete once the next user's begins.
+    follows = Follow.objects.order_by('user_id', 'author_id').values_list(
+        'user_id', 'author_id').iterator(chunk_size=10000)
+    for user_id, author_id in follows:
+        user, author = index.get(user_id), index.get(author_id)
+        if user is None or author is None:  # signed up meanwhile
+            continue
+        while len(offsets) <= user:
+            offsets.append(len(targets))
+        targets.append(author)
+    while len(offsets) <= len(ids):
+        offsets.append(len(targets))
+    return ids, offsets, targets
+
+
+def activity(ids, days):
+    """Activity bonus of every author who posted in the last ``days``."""
+    since = timezone.now() - timedelta(days=days)
+    index = {pk: i for i, pk in enumerate(ids)}
+    counts = Post.objects.filter(pub_date__gte=since).order_by().values(
+        'author_id').annotate(total=Count('id')).values_list(
+        'author_id', 'total')
+    return {index[author_id]: ACTIVITY_WEIGHT * math.log1p(total)
+            for author_id, total in counts if author_id in index}
+
+
+def suggest(user, offsets, targets, bonus, fallback, top):
+    """Best ``top`` (score, author index) pairs for index ``user``."""
+    followed = set(targets[offsets[user]:offsets[user + 1]])
+    followed.add(user)
+    overlap = defaultdict(int)
+    for friend in targets[offsets[user]:offsets[user + 1]]:
+        for candidate in targets[offsets[friend]:offsets[friend + 1]]:
+            if candidate not in followed:
+                overlap[candidate] += 1
+    scored = heapq.nlargest(top, (
+        (count + bonus.get(candidate, 0), candidate)
+        for candidate, count in overlap.items()))
+    for score, candidate in fallback:
+        if len(scored) >= top:
+            break
+        if candidate not in followed and candidate not in overlap:
+            scored.append((score, candidate))
+    return scored
+
+
+def build(top=TOP, days=30):
+    """Recompute and store every user's suggestions; returns the count."""
+    ids, offsets, targets = load_graph()
+    bonus = activity(ids, days)
+    # Enough to top up anyone, whatever they already follow.
+    fallback = heapq.nlargest(
+        top + (max(offsets[i + 1] - offsets[i]
+                   for i in range(len(ids))) if ids else 0) + 1,
+        ((score, author) for author, score in bonus.items()))
+    written = 0
+    for start in range(0, len(ids), BATCH_SIZE):
+        batch = range(start, min(start + BATCH_SIZE, len(ids)))
+        rows = [Suggestion(user_id=ids[user], author_id=ids[author],
+                           rank=rank, score=score)
+                for user in batch
+                for rank, (score, author) in enumerate(
+                    suggest(user, offsets, targets, bonus, fallback, top))]
+        with transaction.atomic():
+            Suggestion.objects.filter(
+                user_id__gte=ids[batch[0]],
+                user_id__lte=ids[batch[-1]]).delete()
+            Suggestion.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+        written += len(rows)
+    caching.bump([caching.SUGGESTIONS_SCOPE])
+    return written
+
+
+def for_user(user, limit=SHOWN):
+    """Suggested authors for ``user`` that they do not follow yet."""
+    if not user.is_authenticated:
+        return []
+    followed = Follow.objects.filter(user=user).values('author_id')
+    return [suggestion.author for suggestion in Suggestion.objects.filter(
+        user=user).exclude(author__in=followed).select_related(
+        'author')[:limit]]
@@ -0,0 +1,20 @@
+from django import template
+
+from posts.cards import render_cards
+
+register = template.Library()
+
+
+def _viewer(context):
+    user = context.get('user')
+    return user if user is not None and user.is_authenticated else None
+
+
+@register.simple_tag(takes_context=True)
+def post_cards(context, posts):
+    return render_cards(posts, _viewer(context))
+
+
+@register.simple_tag(takes_context=True)
+def post_card(context, post):
+    return render_cards([post], _viewer(context))
@@ -1,15 +1,47 @@
+import csv
+import hashlib
+import json
 import os
+import shutil
+import tempfile
+import time
+import zipfile
+from contextlib import contextmanager
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
+from PIL import Image
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.core.management import call_command
+from django.core.paginator import Paginator
+from django.db import connection, connections
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from sorl.thumbnail.default import backend as default_backend
 
-from posts.models import Comment, Follow, Group, Post
+from posts import (cards, entities, media, routers, suggestions,
+                   thumbnails, timeline, trending, urls as posts_urls)
+from posts.cache_backends import FileBasedCache, TwoTierCache
+from posts.models import (Comment, Follow, Group, Post, StoredImage,
+                          Suggestion, TimelineEntry, TrendingScore,
+                          UserStats, comment_count)
 
 
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
 class TestPostMethods(TestCase):
 
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
     def setUp(self):
         self.user = User.objects.create(username='test',
                                         password='test')
@@ -132,11 +164,13 @@ class TestPostMethods(TestCase):
                     'image': _image,
                 },
                 follow=True, )
+        # Stored under its content address (see posts.media).
+        name = media.content_name(hashlib.sha256(small_gif).hexdigest(),
+                                  _image.name)
         for route_name in self.data_for_reverse_func:
             with self.subTest(name=route_name):
                 post = self.get_post_from_page(route_name)
-                self.assertEqual(post.image.name, f'posts/{_image.name}')
-        os.remove(f'media/posts/{_image.name}')
+                self.assertEqual(post.image.name, name)
 
     def test_triggered_protection_download_non_image_file_formats(self):
         _file = SimpleUploadedFile(name='test_image.txt',
@@ -256,3 +290,1354 @@ class TestPostMethods(TestCase):
                 Comment.objects.all().count(),
                 1,
             )
+
+
+class TestCursorPagination(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='cursor',
+                                        password='test')
+        self.posts = [Post.objects.create(text=f'post {i}', author=self.user)
+                      for i in range(25)]
+        self.client = Client()
+
+    def test_cursor_pages_cover_feed_without_gaps(self):
+        seen = []
+        response = self.client.get(reverse('index'), {'cursor': ''})
+        page = response.context['page']
+        self.assertTrue(response.context['paginator'].is_cursor)
+        self.assertFalse(page.has_previous())
+        seen.extend(page)
+        while page.has_next():
+            response = self.client.get(reverse('index'),
+                                       {'cursor': page.next_cursor})
+            page = response.context['page']
+            seen.extend(page)
+        self.assertEqual(seen, sorted(self.posts,
+                                      key=lambda p: (p.pub_date, p.id),
+                                      reverse=True))
+
+    def test_previous_cursor_returns_to_same_page(self):
+        first = self.client.get(reverse('index'),
+                                {'cursor': ''}).context['page']
+        second = self.client.get(reverse('index'),
+                                 {'cursor': first.next_cursor}
+                                 ).context['page']
+        back = self.client.get(reverse('index'),
+                               {'cursor': second.previous_cursor}
+                               ).context['page']
+        self.assertEqual(list(back), list(first))
+
+    def test_malformed_cursor_falls_back_to_first_page(self):
+        response = self.client.get(reverse('index'), {'cursor': '%%%'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['page']), 10)
+
+
+class TestFollowTimeline(TestCase):
+
+    def setUp(self):
+        self.reader = User.objects.create(username='reader')
+        self.author = User.objects.create(username='writer')
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def feed(self):
+        return list(self.client.get(reverse('follow_index')
+                                    ).context['page'])
+
+    def test_follow_backfills_and_new_posts_fan_out(self):
+        old = Post.objects.create(text='old', author=self.author)
+        self.client.get(reverse('profile_follow',
+                                args=[self.author.username]))
+        new = Post.objects.create(text='new', author=self.author)
+        self.assertEqual(self.feed(), [new, old])
+
+    def test_unfollow_and_delete_remove_entries(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(text='post', author=self.author)
+        Post.objects.create(text='other', author=self.author)
+        post.delete()
+        self.assertEqual(len(self.feed()), 1)
+        self.client.get(reverse('profile_unfollow',
+                                args=[self.author.username]))
+        self.assertEqual(self.feed(), [])
+
+    def test_rebuild_command_restores_timeline(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(text='post', author=self.author)
+        TimelineEntry.objects.all().delete()
+        call_command('rebuild_timeline', stdout=StringIO())
+        self.assertEqual(self.feed(), [post])
+
+
+class QueryBudgetMixin:
+    """Fail a test when a block runs more SQL queries than allowed."""
+
+    @contextmanager
+    def assertMaxQueries(self, budget, label=''):
+        with CaptureQueriesContext(connection) as captured:
+            yield captured
+        executed = len(captured)
+        if executed > budget:
+            queries = '\n'.join(q['sql'] for q in captured.captured_queries)
+            self.fail(f'{label} ran {executed} queries, budget is {budget}:'
+                      f'\n{queries}')
+
+
+class TestQueryBudgets(QueryBudgetMixin, TestCase):
+    # Budgets for a logged-in client whose session and user are cached
+    # (cached_db sessions, users.backends) and for an author and group
+    # already in posts.entities; the test warms those first.
+    # Every route in posts/urls.py must be listed, and the numbers must
+    # not depend on how many posts or comments a page shows.
+    BUDGETS = {
+        'index': 2,
+        'new_post': 1,
+        'follow_index': 3,
+        'group_posts': 3,
+        'profile': 5,
+        'profile_follow': 4,
+        'profile_unfollow': 5,
+        'post_view': 3,
+        'post_comments': 3,
+        'export_content': 2,
+        'post_edit': 1,
+        'add_comment': 1,
+        'search': 3,
+        'trending': 2,
+    }
+
+    def setUp(self):
+        self.user = User.objects.create(username='budget')
+        self.author = User.objects.create(username='budget_author')
+        self.group = Group.objects.create(title='Budget', slug='budget',
+                                          description='budget')
+        Follow.objects.create(user=self.user, author=self.author)
+        for i in range(10):
+            post = Post.objects.create(text=f'post {i}', author=self.author,
+                                       group=self.group)
+            for j in range(3):
+                Comment.objects.create(post=post, author=self.user,
+                                       text=f'comment {j}')
+        self.post = post
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def route_kwargs(self, name):
+        post_kwargs = {'username': self.author.username,
+                       'post_id': self.post.id}
+        return {
+            'group_posts': {'slug': self.group.slug},
+            'profile': {'username': self.author.username},
+            'profile_follow': {'username': self.author.username},
+            'profile_unfollow': {'username': self.author.username},
+            'post_view': post_kwargs,
+            'post_comments': post_kwargs,
+            'post_edit': post_kwargs,
+            'add_comment': post_kwargs,
+        }.get(name, {})
+
+    def route_query(self, name):
+        return {'search': {'q': 'post'}}.get(name, {})
+
+    def test_every_route_has_a_budget(self):
+        names = {pattern.name for pattern in posts_urls.urlpatterns}
+        self.assertEqual(names, set(self.BUDGETS))
+
+    def test_routes_stay_within_budget(self):
+        self.client.get(reverse('new_post'))
+        entities.groups.get(self.group.slug)
+        entities.users.get(self.author.username)
+        for name, budget in self.BUDGETS.items():
+            with self.subTest(route=name):
+                url = reverse(name, kwargs=self.route_kwargs(name))
+                with self.assertMaxQueries(budget, label=name):
+                    self.client.get(url, self.route_query(name))
+
+
+class TestFeedQueryPlan(QueryBudgetMixin, TestCase):
+    """Feed pages must not group every post to count its comments."""
+
+    def setUp(self):
+        self.reader = User.objects.create(username='reader')
+        self.author = User.objects.create(username='writer')
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.bulk_create(
+            Post(text=f'post {i}', author=self.author) for i in range(300))
+        posts = list(Post.objects.all())
+        Comment.objects.bulk_create(
+            Comment(post=post, author=self.reader, text='comment')
+            for post in posts for _ in range(3))
+        TimelineEntry.objects.bulk_create(
+            TimelineEntry(user=self.reader, post=post,
+                          author=self.author, pub_date=post.pub_date)
+            for post in posts)
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def plan(self, queryset):
+        sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return ' '.join(row[-1] for row in cursor.fetchall())
+
+    def test_pages_count_comments_without_grouping_the_feed(self):
+        feeds = (Post.objects.for_feed(),
+                 self.reader.timeline.select_related('post').annotate(
+                     comment_count=comment_count('post')))
+        for queryset in feeds:
+            self.assertNotIn('TEMP B-TREE FOR GROUP BY',
+                             self.plan(queryset[:10]))
+            with CaptureQueriesContext(connection) as captured:
+                self.assertEqual(queryset.count(), 300)
+            self.assertNotIn('GROUP BY', captured[0]['sql'])
+
+    def test_page_counts_and_budgets(self):
+        post = Post.objects.for_feed()[0]
+        self.assertEqual(post.comment_count, 3)
+        self.client.get(reverse('new_post'))
+        for name in ('index', 'follow_index'):
+            with self.assertMaxQueries(TestQueryBudgets.BUDGETS[name],
+                                       label=name):
+                response = self.client.get(reverse(name))
+            self.assertEqual(
+                response.context['paginator'].count, 300)
+            self.assertEqual(
+                response.context['page'][0].comment_count, 3)
+
+
+class TestCommentPagination(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='talkative')
+        self.post = Post.objects.create(text='обсуждение', author=self.user)
+        self.comments = [
+            Comment.objects.create(post=self.post, author=self.user,
+                                   text=f'comment {i}')
+            for i in range(25)
+        ]
+        self.kwargs = {'username': self.user.username,
+                       'post_id': self.post.id}
+        self.client = Client()
+
+    def test_post_page_renders_first_page_only(self):
+        response = self.client.get(reverse('post_view', kwargs=self.kwargs))
+        page = response.context['comment_page']
+        self.assertEqual(list(page), self.comments[:20])
+        self.assertContains(response, 'Показать ещё комментарии')
+        self.assertNotContains(response, 'comment 20')
+
+    def test_fragment_continues_from_cursor(self):
+        first = self.client.get(reverse('post_view', kwargs=self.kwargs))
+        cursor = first.context['comment_page'].next_cursor
+        response = self.client.get(reverse('post_comments',
+                                           kwargs=self.kwargs),
+                                   {'cursor': cursor})
+        self.assertEqual(list(response.context['comment_page']),
+                         self.comments[20:])
+        self.assertNotContains(response, 'Показать ещё комментарии')
+        fallback = self.client.get(reverse('post_view', kwargs=self.kwargs),
+                                   {'comments': cursor})
+        self.assertEqual(list(fallback.context['comment_page']),
+                         self.comments[20:])
+
+    def test_json_pages(self):
+        url = reverse('post_comments', kwargs=self.kwargs)
+        data = self.client.get(url, {'format': 'json'}).json()
+        self.assertEqual(len(data['comments']), 20)
+        self.assertEqual(data['comments'][0]['text'], 'comment 0')
+        data = self.client.get(url, {'format': 'json',
+                                     'cursor': data['next']}).json()
+        self.assertEqual([item['text'] for item in data['comments']],
+                         [f'comment {i}' for i in range(20, 25)])
+        self.assertIsNone(data['next'])
+
+
+class TestFeedFragmentCache(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='cached')
+        self.other = User.objects.create(username='stranger')
+        for i in range(15):
+            Post.objects.create(text=f'post {i}', author=self.user)
+        self.client = Client()
+
+    def test_pages_are_cached_separately(self):
+        first = self.client.get(reverse('index')).content.decode()
+        second = self.client.get(reverse('index'),
+                                 {'page': 2}).content.decode()
+        self.assertIn('post 14', first)
+        self.assertNotIn('post 14', second)
+        self.assertIn('post 0', second)
+
+    def test_edit_button_is_not_shared_between_users(self):
+        author_client = Client()
+        author_client.force_login(self.user)
+        stranger_client = Client()
+        stranger_client.force_login(self.other)
+        self.assertIn('Редактировать',
+                      author_client.get(reverse('index')).content.decode())
+        for client in (stranger_client, self.client):
+            with self.subTest(client=client):
+                content = client.get(reverse('index')).content.decode()
+                self.assertNotIn('Редактировать', content)
+
+    def test_new_post_and_comment_invalidate_cached_feed(self):
+        self.client.get(reverse('index'))
+        post = Post.objects.create(text='fresh post', author=self.other)
+        self.assertIn('fresh post',
+                      self.client.get(reverse('index')).content.decode())
+        Comment.objects.create(post=post, author=self.user, text='hi')
+        self.assertIn('Комментариев: 1',
+                      self.client.get(reverse('index')).content.decode())
+
+
+class TestPostCards(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='carded')
+        self.reader = User.objects.create(username='card_reader')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.post = Post.objects.create(text='card text', author=self.author)
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def feed_post(self):
+        return Post.objects.for_feed().get(pk=self.post.pk)
+
+    def test_feed_is_assembled_from_cached_cards(self):
+        self.client.get(reverse('follow_index'))
+        key = cards.card_key(self.feed_post())
+        self.assertIn('card text', cache.get(key))
+        cache.set(key, '<p>from the cache</p>')
+        content = self.client.get(reverse('search'),
+                                  {'q': 'card'}).content.decode()
+        self.assertIn('from the cache', content)
+        self.assertNotIn('card text', content)
+
+    def test_edit_comment_and_rename_change_the_key(self):
+        group = Group.objects.create(title='Карточки', slug='cards',
+                                     description='')
+        self.post.group = group
+        self.post.save()
+        pages = [reverse('index'), reverse('group_posts', args=['cards'])]
+        for url in pages + [reverse('profile', args=['carded'])]:
+            self.client.get(url)  # cache the outer fragments
+        keys = {cards.card_key(self.feed_post())}
+        self.post.text = 'edited'
+        self.post.save()
+        keys.add(cards.card_key(self.feed_post()))
+        Comment.objects.create(post=self.post, author=self.reader, text='hi')
+        keys.add(cards.card_key(self.feed_post()))
+        self.author.username = 'renamed'
+        self.author.save()
+        keys.add(cards.card_key(self.feed_post()))
+        self.assertEqual(len(keys), 4)
+        pages += [reverse('follow_index'),
+                  reverse('profile', args=['renamed'])]
+        for url in pages:
+            with self.subTest(url=url):
+                content = self.client.get(url).content.decode()
+                self.assertIn('@renamed', content)
+                self.assertIn('Комментариев: 1', content)
+        group.title = 'Переименована'
+        group.save()
+        for url in pages:
+            with self.subTest(url=url):
+                self.assertIn('Переименована',
+                              self.client.get(url).content.decode())
+
+    def test_edit_button_is_rendered_live(self):
+        url = reverse('post_view', kwargs={'username': 'carded',
+                                           'post_id': self.post.pk})
+        author_client = Client()
+        author_client.force_login(self.author)
+        self.assertIn('Редактировать',
+                      author_client.get(url).content.decode())
+        content = self.client.get(url).content.decode()
+        self.assertNotIn('Редактировать', content)
+        self.assertNotIn(cards.EDIT_MARKER, content)
+        self.assertIn(cards.EDIT_MARKER,
+                      cache.get(cards.card_key(self.feed_post())))
+
+
+class TestTwoTierCache(TestCase):
+
+    def worker(self, name):
+        # Two local tiers over one shared stand-in, as in two workers.
+        test = self._testMethodName
+        return TwoTierCache('%s-%s' % (test, name), {'OPTIONS': {
+            'SHARED': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'shared-%s' % test,
+            },
+            'LOCAL_MAX_ENTRIES': 2,
+            'SHARED_ONLY': ['version:'],
+        }})
+
+    def test_values_are_shared_and_served_locally(self):
+        first, second = self.worker('first'), self.worker('second')
+        first.set('card:1', 'html')
+        self.assertEqual(second.get('card:1'), 'html')
+        self.assertEqual(second.get('card:1'), 'html')
+        self.assertIsNone(second.get('card:2'))
+        self.assertEqual(second.stats(), {
+            'local': {'hit': 1, 'miss': 2},
+            'shared': {'hit': 1, 'miss': 1},
+        })
+
+    def test_versions_bypass_the_local_tier(self):
+        first, second = self.worker('first'), self.worker('second')
+        first.set('version:index', 1, timeout=None)
+        self.assertEqual(second.get('version:index'), 1)
+        first.incr('version:index')
+        self.assertEqual(second.get('version:index'), 2)
+        self.assertEqual(second.stats()['local'], {'hit': 0, 'miss': 0})
+
+    def test_local_tier_is_bounded(self):
+        worker = self.worker('bounded')
+        worker.set_many({'a': 1, 'b': 2})
+        worker.get('a')
+        worker.set('c', 3)
+        self.assertEqual(list(worker.local.entries),
+                         [worker.make_key('a'), worker.make_key('c')])
+        self.assertEqual(worker.get_many(['a', 'b', 'c']),
+                         {'a': 1, 'b': 2, 'c': 3})
+
+    def test_file_tier_culls_once_per_interval(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        shared = FileBasedCache(directory, {'OPTIONS': {
+            'MAX_ENTRIES': 2, 'CULL_INTERVAL': 60}})
+        with mock.patch.object(shared, '_list_cache_files',
+                               wraps=shared._list_cache_files) as listed:
+            for i in range(5):
+                shared.set('key:%s' % i, i)
+        listed.assert_called_once()
+        self.assertEqual(shared.get('key:4'), 4)
+
+
+class TestReplicaRouting(TestCase):
+    # The replica is a separate empty database: rows written by the test
+    # to the primary are "not replicated yet".
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='primary_author')
+        Post.objects.create(text='only on primary', author=self.author)
+        self.client = Client()
+
+    @override_settings(POSTS_DB_REPLICAS=['replica'])
+    def test_read_views_use_the_replica(self):
+        with CaptureQueriesContext(connections['replica']) as replica:
+            content = self.client.get(reverse('index')).content.decode()
+        self.assertTrue(replica.captured_queries)
+        self.assertNotIn('only on primary', content)
+        response = self.client.get(reverse(
+            'profile', kwargs={'username': 'primary_author'}))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(POSTS_DB_REPLICAS=['replica'])
+    def test_search_matches_and_rows_come_from_the_replica(self):
+        # The post is in the primary's index only: the replica's count
+        # and rows must agree that there is nothing yet.
+        with CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.get(reverse('search'), {'q': 'primary'})
+        self.assertIn('posts_post_search', replica.captured_queries[0]['sql'])
+        self.assertEqual(response.context['paginator'].count, 0)
+        self.assertIn('only on primary', Client().get(
+            reverse('search'), {'q': 'primary'},
+            HTTP_COOKIE='%s=%s' % (routers.PIN_COOKIE, 2 ** 40)
+        ).content.decode())
+
+    def test_without_replicas_everything_reads_the_primary(self):
+        with CaptureQueriesContext(connections['replica']) as replica:
+            content = self.client.get(reverse('index')).content.decode()
+        self.assertFalse(replica.captured_queries)
+        self.assertIn('only on primary', content)
+
+    @override_settings(POSTS_DB_REPLICAS=['replica'])
+    def test_writers_are_pinned_to_the_primary(self):
+        self.client.force_login(self.author)
+        response = self.client.post(reverse('new_post'),
+                                    {'text': 'my own post'})
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+        self.assertIn('my own post',
+                      self.client.get(reverse('index')).content.decode())
+        self.assertNotIn('my own post',
+                         Client().get(reverse('index')).content.decode())
+
+
+class TestEntityCache(TestCase):
+
+    def setUp(self):
+        entities.users.clear()
+        entities.groups.clear()
+        self.user = User.objects.create(username='entity')
+        self.group = Group.objects.create(title='Entity', slug='entity',
+                                          description='')
+
+    def test_hits_skip_the_database(self):
+        entities.users.get('entity')
+        entities.groups.get('entity')
+        with self.assertNumQueries(0):
+            user = entities.users.get('entity')
+            group = entities.groups.get('entity')
+            user.username = 'changed locally'
+        self.assertEqual(group, self.group)
+        self.assertEqual(entities.users.get('entity').username, 'entity')
+        self.assertIsNone(entities.users.get('nobody'))
+
+    def test_saves_and_deletes_invalidate(self):
+        entities.users.get('entity')
+        entities.groups.get('entity')
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertIsNone(entities.users.get('entity'))
+        self.assertEqual(entities.users.get('renamed'), self.user)
+        self.group.delete()
+        self.assertIsNone(entities.groups.get('entity'))
+        response = self.client.get(reverse('group_posts',
+                                           kwargs={'slug': 'entity'}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_changes_reach_other_workers(self):
+        other = entities.EntityCache(User, 'username')
+        self.assertEqual(other.get('entity'), self.user)
+        self.user.first_name = 'Лев'
+        self.user.save()
+        self.assertEqual(other.get('entity').first_name, 'Лев')
+        self.client.force_login(self.user)
+        with self.assertNumQueries(0):
+            other.get('entity')
+
+    @override_settings(POSTS_ENTITY_CACHE_SIZE=2)
+    def test_cache_is_bounded(self):
+        for name in ('one', 'two', 'three'):
+            User.objects.create(username=name)
+            entities.users.get(name)
+        self.assertEqual(list(entities.users.entries), ['two', 'three'])
+
+
+class TestSuggestions(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        self.users = {name: User.objects.create(username=name)
+                      for name in ('ann', 'bob', 'cid', 'dan', 'eve', 'fay')}
+        for user, author in (('ann', 'bob'), ('ann', 'eve'), ('bob', 'cid'),
+                             ('eve', 'cid'), ('bob', 'dan')):
+            Follow.objects.create(user=self.users[user],
+                                  author=self.users[author])
+        for _ in range(3):
+            Post.objects.create(text='active', author=self.users['fay'])
+
+    def suggested(self, name):
+        return [author.username for author
+                in suggestions.for_user(self.users[name])]
+
+    def test_friends_of_friends_rank_first(self):
+        call_command('build_suggestions', stdout=StringIO())
+        # cid is followed by two of ann's followees, dan by one; fay has
+        # no link to ann but is the most active author.
+        self.assertEqual(self.suggested('ann'), ['cid', 'dan', 'fay'])
+        self.assertEqual(self.suggested('fay'), [])  # the only active author
+
+    def test_graph_is_compact_and_built_in_batches(self):
+        ids, offsets, targets = suggestions.load_graph()
+        self.assertEqual((ids.typecode, offsets.typecode), ('i', 'i'))
+        ann = list(ids).index(self.users['ann'].id)
+        self.assertEqual(
+            [ids[i] for i in targets[offsets[ann]:offsets[ann + 1]]],
+            [self.users['bob'].id, self.users['eve'].id])
+        self.assertEqual(offsets[-1], len(targets))
+        with mock.patch('posts.suggestions.BATCH_SIZE', 2):
+            written = suggestions.build()
+        self.assertEqual(written, Suggestion.objects.count())
+        self.assertEqual(self.suggested('ann'), ['cid', 'dan', 'fay'])
+
+    def test_followed_authors_are_not_shown(self):
+        suggestions.build()
+        Follow.objects.create(user=self.users['ann'], author=self.users['cid'])
+        with self.assertMaxQueries(1):
+            self.assertEqual(self.suggested('ann'), ['dan', 'fay'])
+        client = Client()
+        client.force_login(self.users['ann'])
+        response = client.get(reverse('follow_index'))
+        self.assertEqual([author.username
+                          for author in response.context['suggestions']],
+                         ['dan', 'fay'])
+
+    def test_profile_revalidates_when_suggestions_change(self):
+        suggestions.build()
+        client = Client()
+        client.force_login(self.users['ann'])
+        profile = reverse('profile', kwargs={'username': 'bob'})
+        etag = client.get(profile)['ETag']
+        Follow.objects.create(user=self.users['ann'], author=self.users['cid'])
+        response = client.get(profile, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([author.username
+                          for author in response.context['suggestions']],
+                         ['dan', 'fay'])
+        etag = response['ETag']
+        suggestions.build()
+        response = client.get(profile, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class TestTrending(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='trendy')
+        self.posts = [Post.objects.create(text=f'post {i}', author=self.user)
+                      for i in range(3)]
+        self.tau = timedelta(hours=settings.POSTS_TRENDING_DECAY_HOURS)
+
+    def ranked(self):
+        return list(TrendingScore.objects.order_by(
+            '-score', '-post_id').values_list('post_id', flat=True))
+
+    def test_recent_comment_outranks_older_ones(self):
+        old, fresh, _ = self.posts
+        two_periods_ago = timezone.now() - 2 * self.tau
+        trending.record_comments([(old.id, two_periods_ago)] * 3)
+        Comment.objects.create(post=fresh, author=self.user, text='сейчас')
+        # 3 * e^-2 is less than one fresh comment.
+        self.assertEqual(self.ranked(), [fresh.id, old.id])
+
+    def test_incremental_score_matches_rebuild(self):
+        for post in self.posts[:2]:
+            for i in range(3):
+                Comment.objects.create(post=post, author=self.user,
+                                       text=f'comment {i}')
+        incremental = dict(TrendingScore.objects.values_list(
+            'post_id', 'score'))
+        self.assertEqual(trending.rebuild(), 2)
+        rebuilt = dict(TrendingScore.objects.values_list('post_id', 'score'))
+        self.assertEqual(set(incremental), set(rebuilt))
+        for post_id, score in rebuilt.items():
+            self.assertAlmostEqual(incremental[post_id], score, places=6)
+
+    def test_rows_keep_the_comment_count(self):
+        post = self.posts[0]
+        Comment.objects.bulk_create([Comment(post=post, author=self.user,
+                                             text='до')] * 2)
+        comment = Comment.objects.create(post=post, author=self.user,
+                                         text='первый в ленте')
+        self.assertEqual(post.trending.comment_count, 3)
+        trending.record_comments(
+            [(post.id, timezone.now() - 30 * self.tau)])  # too old to score
+        comment.delete()
+        entry = TrendingScore.objects.get()
+        self.assertEqual(entry.comment_count, 3)  # 2 + 1 + 1 - 1
+        trending.rebuild()
+        self.assertEqual(TrendingScore.objects.get().comment_count,
+                         post.comments.count())
+
+    @override_settings(POSTS_TRENDING_SIZE=1)
+    def test_compaction_drops_stale_and_surplus_rows(self):
+        stale, low, high = self.posts
+        trending.record_comments([
+            (low.id, timezone.now()),
+            (high.id, timezone.now()), (high.id, timezone.now()),
+        ])
+        TrendingScore.objects.create(post=stale, score=trending.position(
+            timezone.now() - 10 * self.tau))
+        out = StringIO()
+        call_command('compact_trending', stdout=out)
+        self.assertIn('2 rows deleted', out.getvalue())
+        self.assertEqual(self.ranked(), [high.id])
+
+    def test_feed_pages_like_index(self):
+        for post in self.posts:
+            Comment.objects.create(post=post, author=self.user, text='+1')
+        client = Client()
+        with self.assertMaxQueries(TestQueryBudgets.BUDGETS['trending']):
+            response = client.get(reverse('trending'))
+        self.assertIs(type(response.context['paginator']), Paginator)
+        self.assertEqual([post.id for post in response.context['page']],
+                         [post.id for post in reversed(self.posts)])
+        self.assertEqual(response.context['page'][0].comment_count, 1)
+        response = client.get(reverse('trending'), {'cursor': ''})
+        self.assertEqual(len(response.context['page']), 3)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class TestMediaDedupe(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='reposter')
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.content = self.png('green')
+
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def png(self, color):
+        buffer = BytesIO()
+        Image.new('RGB', (8, 8), color).save(buffer, format='PNG')
+        return buffer.getvalue()
+
+    def upload(self, name):
+        self.client.post(reverse('new_post'), {
+            'image': SimpleUploadedFile(name, self.content),
+            'text': name,
+        })
+        return Post.objects.get(text=name)
+
+    def refs(self, name):
+        return StoredImage.objects.filter(name=name).values_list(
+            'refs', flat=True).first()
+
+    def stored(self):
+        return sorted(name for name, _ in media._stored_files())
+
+    def committed(self):
+        # TestCase never commits, so run on_commit callbacks right away.
+        return mock.patch('django.db.transaction.on_commit',
+                          lambda callback: callback())
+
+    def test_same_picture_is_stored_once(self):
+        first = self.upload('cat.png')
+        second = self.upload('copy of cat.PNG')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(self.stored(), [first.image.name])
+        self.assertEqual(self.refs(first.image.name), 2)
+        with default_storage.open(first.image.name) as stream:
+            self.assertEqual(stream.read(), self.content)
+
+    def test_copies_share_thumbnails(self):
+        first = self.upload('cat.png')
+        thumbnails.generate(first.image.name)
+        second = self.upload('cat again.png')
+        with mock.patch('posts.thumbnails._submit') as submit:
+            image = default_backend.get_thumbnail(
+                second.image, '960x339', crop='center', upscale=True)
+        submit.assert_not_called()
+        self.assertTrue(image.name.startswith('cache/'))
+
+    def test_file_is_deleted_with_its_last_post(self):
+        first = self.upload('cat.png')
+        second = self.upload('cat again.png')
+        name = first.image.name
+        with self.committed():
+            first.delete()
+        self.assertEqual(self.refs(name), 1)
+        self.assertTrue(default_storage.exists(name))
+        with self.committed():
+            second.delete()
+        self.assertIsNone(self.refs(name))
+        self.assertFalse(default_storage.exists(name))
+
+    def test_bulk_written_posts_keep_the_file(self):
+        uploaded = self.upload('cat.png')
+        name = uploaded.image.name
+        path = os.path.join(tempfile.mkdtemp(), 'import.ndjson')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w', encoding='utf-8') as stream:
+            stream.write(json.dumps({
+                'type': 'post', 'id': 1, 'author': self.user.username,
+                'text': 'импорт', 'date': '2020-01-01T10:00:00Z',
+                'image': name}) + '\n')
+        call_command('import_content', path, stdout=StringIO())
+        self.assertEqual(self.refs(name), 2)
+        # Rows nobody counted still hold on to the file.
+        Post.objects.bulk_create([Post(text='bulk', author=self.user,
+                                       image=name)])
+        with self.committed():
+            uploaded.delete()
+            Post.objects.get(text='импорт').delete()
+        self.assertIsNone(self.refs(name))
+        self.assertTrue(default_storage.exists(name))
+
+    def test_dedupe_media_collapses_existing_copies(self):
+        legacy = []
+        for name, content in (('a.png', self.content), ('b.png', self.content),
+                              ('c.png', self.png('blue'))):
+            path = os.path.join(settings.MEDIA_ROOT, 'posts', name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as stream:
+                stream.write(content)
+            legacy.append(Post.objects.create(
+                text=name, author=self.user, image='posts/' + name))
+        out = StringIO()
+        call_command('dedupe_media', stdout=out)
+        self.assertIn('3 files, 1 duplicates removed', out.getvalue())
+        a, b, c = [Post.objects.get(pk=post.pk).image.name for post in legacy]
+        self.assertEqual(a, b)
+        self.assertEqual(self.stored(), sorted([a, c]))
+        self.assertEqual(self.refs(a), 2)
+        self.assertEqual(self.refs(c), 1)
+        # New uploads of the same picture land on the collapsed file.
+        self.assertEqual(self.upload('d.png').image.name, a)
+
+
+class TestUserStats(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='counted')
+        self.author = User.objects.create(username='popular')
+
+    def stats(self, user):
+        return UserStats.objects.get(user=user)
+
+    def test_counters_follow_posts_and_follows(self):
+        post = Post.objects.create(text='post', author=self.author)
+        Follow.objects.create(user=self.user, author=self.author)
+        self.assertEqual(
+            (self.stats(self.author).posts, self.stats(self.author).followers,
+             self.stats(self.user).following), (1, 1, 1))
+        post.delete()
+        Follow.objects.all().delete()
+        self.assertEqual(
+            (self.stats(self.author).posts, self.stats(self.author).followers,
+             self.stats(self.user).following), (0, 0, 0))
+
+    def test_reconcile_counters_repairs_drift(self):
+        Post.objects.create(text='post', author=self.author)
+        UserStats.objects.filter(user=self.author).update(posts=7)
+        UserStats.objects.filter(user=self.user).delete()
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertEqual(self.stats(self.author).posts, 1)
+        self.assertEqual(self.stats(self.user).posts, 0)
+
+    def test_user_deletion_keeps_counters_consistent(self):
+        Post.objects.create(text='post', author=self.author)
+        Follow.objects.create(user=self.user, author=self.author)
+        self.author.delete()
+        self.assertEqual(self.stats(self.user).following, 0)
+
+
+class TestFollowConstraints(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='fan')
+        self.author = User.objects.create(username='idol')
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def test_repeated_follow_creates_single_row(self):
+        for _ in range(2):
+            self.client.get(reverse('profile_follow',
+                                    args=[self.author.username]))
+        self.assertEqual(Follow.objects.count(), 1)
+        self.assertEqual(UserStats.objects.get(user=self.author).followers, 1)
+
+    def test_self_follow_is_ignored(self):
+        self.client.get(reverse('profile_follow',
+                                args=[self.user.username]))
+        self.assertFalse(Follow.objects.exists())
+
+    def test_bench_indexes_leaves_database_untouched(self):
+        out = StringIO()
+        call_command('bench_indexes', seed=100, repeat=1, stdout=out)
+        self.assertIn('post_pub_date_idx', out.getvalue())
+        self.assertEqual(Post.objects.count(), 0)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class TestDeferredThumbnails(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        buffer = BytesIO()
+        Image.new('RGB', (40, 30), 'red').save(buffer, format='PNG')
+        self.name = default_storage.save('posts/thumb.png',
+                                         ContentFile(buffer.getvalue()))
+
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def render(self):
+        return default_backend.get_thumbnail(self.name, '960x339',
+                                             crop='center', upscale=True)
+
+    def test_missing_thumbnail_is_queued_not_rendered(self):
+        with mock.patch('posts.thumbnails._submit') as submit:
+            image = self.render()
+        submit.assert_called_once()
+        self.assertEqual(image.name, self.name)
+
+    def test_generated_thumbnail_is_served_from_store(self):
+        thumbnails.generate(self.name)
+        with mock.patch('posts.thumbnails._submit') as submit:
+            image = self.render()
+        submit.assert_not_called()
+        self.assertTrue(image.name.startswith('cache/'))
+        self.assertEqual((image.width, image.height), (960, 339))
+
+    def test_cached_feed_picks_up_finished_thumbnail(self):
+        author = User.objects.create(username='painter')
+        Post.objects.create(text='picture', author=author, image=self.name)
+        with mock.patch('posts.thumbnails._submit') as submit:
+            before = self.client.get(reverse('index')).content.decode()
+        self.assertIn(default_storage.url(self.name), before)
+        for call in submit.call_args_list:
+            thumbnails._run(*call[0])
+        after = self.client.get(reverse('index')).content.decode()
+        self.assertNotIn(default_storage.url(self.name), after)
+        self.assertIn(settings.MEDIA_URL + 'cache/', after)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class TestContentExport(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='exporter')
+        buffer = BytesIO()
+        Image.new('RGB', (4, 4), 'blue').save(buffer, format='PNG')
+        self.image = default_storage.save('posts/export.png',
+                                          ContentFile(buffer.getvalue()))
+        self.post = Post.objects.create(text='пост, с "кавычками"',
+                                        author=self.user, image=self.image)
+        Post.objects.create(text='второй', author=self.user)
+        Comment.objects.create(post=self.post, author=self.user,
+                               text='мой комментарий')
+        Post.objects.create(text='чужой', author=User.objects.create(
+            username='other'))
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def download(self, **params):
+        response = self.client.get(reverse('export_content'), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_ndjson_streams_own_posts_then_comments(self):
+        rows = [json.loads(line)
+                for line in self.download().decode().splitlines()]
+        self.assertEqual([(row['type'], row['text']) for row in rows], [
+            ('post', 'пост, с "кавычками"'),
+            ('post', 'второй'),
+            ('comment', 'мой комментарий'),
+        ])
+        self.assertEqual(rows[0]['image'], self.image)
+        self.assertEqual(rows[2]['post'], self.post.id)
+
+    def test_csv_round_trips(self):
+        content = self.download(format='csv').decode()
+        rows = list(csv.DictReader(content.splitlines()))
+        self.assertEqual(rows[0]['text'], 'пост, с "кавычками"')
+        self.assertEqual(len(rows), 3)
+
+    def test_zip_includes_images(self):
+        archive = zipfile.ZipFile(BytesIO(self.download(images='1')))
+        self.assertEqual(archive.namelist(),
+                         ['exporter.ndjson', self.image])
+        with default_storage.open(self.image) as source:
+            self.assertEqual(archive.read(self.image), source.read())
+
+    def test_command_writes_the_same_export(self):
+        path = os.path.join(tempfile.mkdtemp(), 'export.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        call_command('export_content', 'exporter', format='csv',
+                     output=path)
+        with open(path, 'rb') as stream:
+            self.assertEqual(stream.read(), self.download(format='csv'))
+
+
+class TestContentImport(TestCase):
+
+    RECORDS = [
+        {'type': 'group', 'slug': 'imported', 'title': 'Импорт'},
+        {'type': 'post', 'id': 1, 'author': 'leo', 'group': 'imported',
+         'text': 'первый импортированный', 'date': '2020-01-01T10:00:00Z'},
+        {'type': 'post', 'id': 2, 'author': 'leo',
+         'text': 'второй', 'date': '2020-01-02T10:00:00Z'},
+        {'type': 'comment', 'post': 1, 'author': 'reader', 'text': 'ответ',
+         'date': '2020-01-03T10:00:00Z'},
+        {'type': 'follow', 'user': 'reader', 'author': 'leo'},
+        {'type': 'post', 'id': 3, 'author': 'ghost', 'text': 'никто',
+         'date': '2020-01-04T10:00:00Z'},
+    ]
+
+    def setUp(self):
+        self.leo = User.objects.create(username='leo')
+        self.reader = User.objects.create(username='reader')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'import.ndjson')
+        with open(self.path, 'w', encoding='utf-8') as stream:
+            for record in self.RECORDS:
+                stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+            stream.write('not json\n')
+
+    def run_import(self, *args):
+        out, err = StringIO(), StringIO()
+        call_command('import_content', self.path, *args, stdout=out,
+                     stderr=err, batch_size=2)
+        return out.getvalue(), err.getvalue()
+
+    def test_rows_and_derived_tables(self):
+        out, err = self.run_import()
+        self.assertIn("unknown author 'ghost'", err)
+        self.assertIn('line 7', err)
+        first = Post.objects.get(text='первый импортированный')
+        self.assertEqual(first.group.slug, 'imported')
+        self.assertEqual(first.pub_date.isoformat(),
+                         '2020-01-01T10:00:00+00:00')
+        self.assertEqual(first.updated, first.comments.get().created)
+        self.assertEqual(first.comments.get().author, self.reader)
+        self.assertEqual(self.reader.timeline.count(), 2)
+        self.assertEqual(UserStats.objects.get(user=self.leo).posts, 2)
+        self.assertEqual(UserStats.objects.get(user=self.leo).followers, 1)
+        self.assertEqual(self.client.get(
+            reverse('search'), {'q': 'импортированный'}).context[
+                'paginator'].count, 1)
+
+    def test_rerun_skips_everything(self):
+        self.run_import()
+        out, _ = self.run_import()
+        self.assertEqual(Post.objects.count(), 2)
+        self.assertEqual(Comment.objects.count(), 1)
+        self.assertEqual(Follow.objects.count(), 1)
+        self.assertEqual(Group.objects.count(), 1)
+        self.assertRegex(out, r'post +created +0 +skipped +3')
+
+    def test_records_without_ids_are_skipped(self):
+        with open(self.path, 'w', encoding='utf-8') as stream:
+            for record in (
+                    {'type': 'post', 'author': 'leo', 'text': 'без id',
+                     'date': '2020-01-05T10:00:00Z'},
+                    {'type': 'comment', 'author': 'reader', 'text': 'куда?',
+                     'date': '2020-01-06T10:00:00Z'}):
+                stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+        _, err = self.run_import()
+        self.assertIn('no id', err)
+        self.assertIn('unknown post None', err)
+        self.assertFalse(Post.objects.exists())
+        self.assertFalse(Comment.objects.exists())
+
+    def test_posts_are_told_apart_by_text(self):
+        with open(self.path, 'w', encoding='utf-8') as stream:
+            for i, text in enumerate(('один', 'два', 'один'), 1):
+                stream.write(json.dumps({
+                    'type': 'post', 'id': i, 'author': 'leo', 'text': text,
+                    'date': '2020-01-05T10:00:00Z'}, ensure_ascii=False)
+                    + '\n')
+            stream.write(json.dumps({
+                'type': 'comment', 'post': 3, 'author': 'reader',
+                'text': 'ко второму одному',
+                'date': '2020-01-06T10:00:00Z'}, ensure_ascii=False) + '\n')
+        out, err = self.run_import()
+        self.assertIn('line 3: same post as line 1', err)
+        self.assertRegex(out, r'post +created +2 +skipped +1')
+        first, second = Post.objects.order_by('id')
+        self.assertEqual((first.text, second.text), ('один', 'два'))
+        self.assertEqual(first.pub_date, second.pub_date)
+        self.assertEqual(first.comments.get().text, 'ко второму одному')
+        self.assertEqual(first.comments.get().created.isoformat(),
+                         '2020-01-06T10:00:00+00:00')
+
+    def test_timeline_batches_tolerate_existing_entries(self):
+        self.run_import()
+        follow = Follow.objects.get()
+        timeline.add_follows([follow.id])
+        timeline.fan_out_posts(list(Post.objects.values_list(
+            'id', flat=True)))
+        self.assertEqual(self.reader.timeline.count(), 2)
+
+    def test_unknown_authors_can_be_created(self):
+        self.run_import('--create-users')
+        ghost = User.objects.get(username='ghost')
+        self.assertFalse(ghost.has_usable_password())
+        self.assertEqual(ghost.posts.get().text, 'никто')
+
+
+class TestUploadLimits(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='uploader')
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def upload(self, name, content):
+        return self.client.post(reverse('new_post'), {
+            'image': SimpleUploadedFile(name, content),
+            'text': 'test',
+        })
+
+    def test_oversized_file_is_rejected_while_streaming(self):
+        content = b'GIF89a' + b'\x00' * settings.POSTS_MAX_UPLOAD_SIZE
+        with mock.patch('django.core.files.uploadhandler.'
+                        'MemoryFileUploadHandler.file_complete') as stored:
+            response = self.upload('big.gif', content)
+        stored.assert_not_called()
+        self.assertFormError(response, 'form', 'image',
+                             'Максимальный разрешенный размер файла 1MB')
+        self.assertFalse(Post.objects.exists())
+
+    def test_decompression_bomb_is_rejected_from_header(self):
+        buffer = BytesIO()
+        Image.new('1', (5000, 5000)).save(buffer, format='PNG')
+        self.assertLess(len(buffer.getvalue()),
+                        settings.POSTS_MAX_UPLOAD_SIZE)
+        with mock.patch('PIL.ImageFile.ImageFile.load') as load:
+            response = self.upload('bomb.png', buffer.getvalue())
+        load.assert_not_called()
+        self.assertIn('image', response.context['form'].errors)
+        self.assertFalse(Post.objects.exists())
+
+
+class TestPostSearch(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='searcher',
+                                        is_staff=True, is_superuser=True)
+        self.group = Group.objects.create(title='Котики', slug='cats',
+                                          description='')
+        self.client = Client()
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('search'), {'q': query, **params})
+        return list(response.context['page'])
+
+    def test_results_are_ranked_and_paginated(self):
+        weak = Post.objects.create(text='кот и собака', author=self.user)
+        strong = Post.objects.create(text='кот кот кот', author=self.user)
+        for i in range(11):
+            Post.objects.create(text=f'кот номер {i} ' + 'слово ' * 20,
+                                author=self.user)
+        first = self.search('кот')
+        self.assertEqual(first[0], strong)
+        self.assertEqual(len(first), 10)
+        self.assertEqual(len(self.search('кот', page=2)), 3)
+        self.assertIn(weak, first)
+
+    def test_index_follows_edits_deletes_and_group_titles(self):
+        post = Post.objects.create(text='старый текст', author=self.user,
+                                   group=self.group)
+        self.assertEqual(self.search('котики'), [post])
+        post.text = 'новый текст'
+        post.save()
+        self.assertEqual(self.search('старый'), [])
+        self.assertEqual(self.search('новый'), [post])
+        self.group.title = 'Собачки'
+        self.group.save()
+        self.assertEqual(self.search('собачки'), [post])
+        post.delete()
+        self.assertEqual(self.search('новый'), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        Post.objects.create(text='a OR b', author=self.user)
+        for query in ('"', 'OR', 'NEAR(', '*', ''):
+            with self.subTest(query=query):
+                self.assertEqual(
+                    self.client.get(reverse('search'),
+                                    {'q': query}).status_code, 200)
+
+    def test_admin_search_uses_index(self):
+        post = Post.objects.create(text='искомая запись', author=self.user)
+        Post.objects.create(text='другое', author=self.user)
+        self.client.force_login(self.user)
+        response = self.client.get('/admin/posts/post/', {'q': 'искомая'})
+        self.assertEqual(list(response.context['cl'].result_list), [post])
+
+
+class TestConditionalGet(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='conditional')
+        self.reader = User.objects.create(username='reader')
+        self.group = Group.objects.create(title='Группа', slug='conditional',
+                                          description='')
+        self.post = Post.objects.create(text='текст', author=self.user,
+                                        group=self.group)
+        self.client = Client()
+        self.urls = [
+            reverse('post_view', kwargs={'username': self.user.username,
+                                         'post_id': self.post.id}),
+            reverse('profile', kwargs={'username': self.user.username}),
+            reverse('group_posts', kwargs={'slug': self.group.slug}),
+        ]
+
+    def test_unchanged_pages_are_not_rendered(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                first = self.client.get(url)
+                self.assertFalse(first.has_header('Last-Modified'))
+                with self.assertMaxQueries(1, label=url):
+                    response = self.client.get(
+                        url, HTTP_IF_NONE_MATCH=first['ETag'])
+                self.assertEqual(response.status_code, 304)
+
+    def test_if_modified_since_alone_is_not_trusted(self):
+        # A comment in the same second and a follow leave Post.updated
+        # (nearly) unchanged; only the ETag sees them.
+        since = http_date(time.time() + 60)
+        self.client.force_login(self.reader)
+        for change in (
+                lambda: Comment.objects.create(post=self.post,
+                                               author=self.reader, text='!'),
+                lambda: Follow.objects.create(user=self.reader,
+                                              author=self.user)):
+            change()
+            for url in self.urls:
+                with self.subTest(url=url):
+                    response = self.client.get(
+                        url, HTTP_IF_MODIFIED_SINCE=since)
+                    self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.urls[1],
+                                   HTTP_IF_MODIFIED_SINCE=since)
+        self.assertEqual(response.context['following'], True)
+
+    def test_comment_and_new_post_change_validators(self):
+        etags = [self.client.get(url)['ETag'] for url in self.urls]
+        Comment.objects.create(post=self.post, author=self.reader, text='!')
+        for url, etag in zip(self.urls, etags):
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+        etag = self.client.get(self.urls[2])['ETag']
+        self.post.delete()
+        response = self.client.get(self.urls[2], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_validators_depend_on_viewer_and_follow_state(self):
+        profile = self.urls[1]
+        anonymous = self.client.get(profile)['ETag']
+        self.client.force_login(self.reader)
+        etag = self.client.get(profile)['ETag']
+        self.assertNotEqual(etag, anonymous)
+        Follow.objects.create(user=self.reader, author=self.user)
+        response = self.client.get(profile, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['following'], True)
+
+    def test_renames_change_validators(self):
+        post, profile, group = self.urls
+        etags = [self.client.get(url)['ETag'] for url in (post, group)]
+        self.group.title = 'Другая группа'
+        self.group.save()
+        for url, etag in zip((post, group), etags):
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+        etag = self.client.get(group)['ETag']
+        self.user.username = 'renamed'
+        self.user.save()
+        response = self.client.get(group, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'renamed')
+
+    def test_validators_do_not_scan_posts(self):
+        for i in range(20):
+            Post.objects.create(text=f'ещё {i}', author=self.user,
+                                group=self.group)
+        for url in self.urls:
+            etag = self.client.get(url)['ETag']
+            with self.subTest(url=url), CaptureQueriesContext(
+                    connection) as captured:
+                self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            sql = captured[0]['sql']
+            self.assertNotIn('MAX(', sql)
+            self.assertNotIn('COUNT(', sql)
+
+
+class TestJsonApi(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='api_author')
+        self.reader = User.objects.create(username='api_reader')
+        self.group = Group.objects.create(title='API', slug='api',
+                                          description='')
+        self.posts = [
+            Post.objects.create(text=f'post {i}', author=self.user,
+                                group=self.group if i % 2 else None)
+            for i in range(15)
+        ]
+        Comment.objects.create(post=self.posts[-1], author=self.reader,
+                               text='first')
+        self.client = Client()
+
+    def test_feed_pages_follow_the_cursor(self):
+        url = reverse('api_index')
+        with self.assertMaxQueries(1, label='api_index'):
+            data = self.client.get(url).json()
+        self.assertEqual([item['id'] for item in data['results']],
+                         [post.id for post in self.posts[:4:-1]])
+        self.assertNotIn('comment_count', data['results'][0])
+        self.assertEqual(data['results'][0]['author'], 'api_author')
+        data = self.client.get(url, {'cursor': data['next']}).json()
+        self.assertEqual([item['id'] for item in data['results']],
+                         [post.id for post in self.posts[4::-1]])
+        self.assertIsNone(data['next'])
+
+    def test_fields_and_limit_are_selectable(self):
+        response = self.client.get(reverse('api_group_posts',
+                                           kwargs={'slug': 'api'}),
+                                   {'fields': 'id,group', 'limit': 2})
+        self.assertEqual(response.json()['results'], [
+            {'id': self.posts[13].id, 'group': 'api'},
+            {'id': self.posts[11].id, 'group': 'api'},
+        ])
+        response = self.client.get(reverse('api_index'),
+                                   {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_follow_feed_and_single_post(self):
+        url = reverse('api_follow_index')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        Follow.objects.create(user=self.reader, author=self.user)
+        self.client.force_login(self.reader)
+        data = self.client.get(url, {'fields': 'id,comment_count'}).json()
+        self.assertEqual(data['results'][0],
+                         {'id': self.posts[-1].id, 'comment_count': 1})
+        post = self.client.get(reverse(
+            'api_post', kwargs={'post_id': self.posts[0].id})).json()
+        self.assertEqual(post['text'], 'post 0')
+        self.assertIsNone(post['image'])
+        comments = self.client.get(reverse(
+            'api_post_comments', kwargs={'post_id': self.posts[-1].id}))
+        self.assertEqual(comments.json()['results'][0]['text'], 'first')
+        self.assertEqual(self.client.get(reverse(
+            'api_post', kwargs={'post_id': 0})).status_code, 404)
+
+
+class TestRequestMetrics(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='metered')
+        Post.objects.create(text='measured', author=self.user)
+
+    @override_settings(POSTS_METRICS_TOKEN='scrape-secret')
+    def test_index_is_measured(self):
+        self.client.get(reverse('index'))
+        body = self.client.get(
+            reverse('metrics'),
+            HTTP_AUTHORIZATION='Bearer scrape-secret').content.decode()
+        for line in ('yatube_request_duration_seconds_count{view="index"}',
+                     'yatube_sql_queries_bucket{view="index",le="+Inf"}',
+                     'yatube_template_render_seconds_sum{view="index"}',
+                     'yatube_responses_total{view="index",status="200"}',
+                     'yatube_cache_lookups_total{view="index",result='):
+            self.assertIn(line, body)
+
+    @override_settings(POSTS_METRICS_TOKEN='scrape-secret')
+    def test_metrics_are_internal(self):
+        # Whatever the address: a local proxy makes everyone 127.0.0.1.
+        for headers in ({'REMOTE_ADDR': '127.0.0.1'},
+                        {'HTTP_AUTHORIZATION': 'Bearer wrong'}):
+            with self.subTest(headers=headers):
+                response = self.client.get(reverse('metrics'), **headers)
+                self.assertEqual(response.status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('metrics'),
+                                   REMOTE_ADDR='203.0.113.7')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(POSTS_SLOW_REQUEST_SECONDS=0)
+    def test_slow_requests_are_logged_with_sql(self):
+        with self.assertLogs('posts.slow', 'WARNING') as logs:
+            self.client.get(reverse('profile', kwargs={'username': 'metered'}))
+        self.assertIn('(profile)', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
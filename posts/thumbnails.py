@@ -0,0 +1,151 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+
+logger = logging.getLogger(__name__)
+
+# Every geometry the templates request, with its options; keep in sync
+# with the {% thumbnail %} tags so the pre-generated files are the ones
+# the pages look up.
+SIZES = (
+    ('960x339', {'crop': 'center', 'upscale': True}),
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = set()
+_pending_lock = threading.Lock()
+_local = threading.local()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails')
+        return _executor
+
+
+class DeferredThumbnailBackend(ThumbnailBackend):
+    """Never renders inside a request.
+
+    A thumbnail already in the key-value store is returned as usual; a
+    missing one is queued for the background pool and the original image
+    is served until it is ready.
+    """
+
+    def get_thumbnail(self, file_, geometry_string, **options):
+        if not file_:
+            raise ValueError('falsey file_ argument in get_thumbnail()')
+        source = ImageFile(file_)
+        name = self._get_thumbnail_filename(
+            source, geometry_string, self._with_defaults(source, options))
+        cached = default.kvstore.get(ImageFile(name, default.storage))
+        if cached:
+            return cached
+        _submit(source.name, geometry_string, options)
+        _local.served_originals = served_originals() + 1
+        return source
+
+    def generate(self, file_, geometry_string, **options):
+        return super().get_thumbnail(file_, geometry_string, **options)
+
+    def _with_defaults(self, source, options):
+        # Mirrors the option handling of ThumbnailBackend.get_thumbnail so
+        # that the computed filename matches the generated one.
+        options = dict(options)
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        return options
+
+
+def generate(name, force=False):
+    """Render every configured size of the image stored at ``name``."""
+    if force:
+        default.kvstore.delete_thumbnails(ImageFile(name))
+    backend = DeferredThumbnailBackend()
+    for geometry, options in SIZES:
+        backend.generate(name, geometry, **options)
+
+
+def served_originals():
+    """How many originals this thread has served in place of thumbnails."""
+    return getattr(_local, 'served_originals', 0)
+
+
+def _refresh_feeds(name):
+    # Feed fragments rendered while the thumbnail was pending hold the
+    # original image; move their scopes on so the next request sees it.
+    from .caching import bump, scopes_for_post
+    from .models import Post
+    scopes = set()
+    for post in Post.objects.filter(image=name).only('author', 'group'):
+        scopes.update(scopes_for_post(post))
+    bump(sorted(scopes))
+
+
+def _run(name, geometry, options):
+    try:
+        DeferredThumbnailBackend().generate(name, geometry, **options)
+        _refresh_feeds(name)
+    except Exception:
+        logger.exception('Thumbnail %s of %s failed', geometry, name)
+    finally:
+        with _pending_lock:
+            _pending.discard((name, geometry))
+
+
+def _run_in_worker(name, geometry, options):
+    try:
+        _run(name, geometry, options)
+    finally:
+        connection.close()
+
+
+def _shares_memory_database():
+    return (connection.vendor == 'sqlite'
+            and connection.is_in_memory_db())
+
+
+def _submit(name, geometry, options):
+    key = (name, geometry)
+    # Checked and claimed in one step: request threads race for it.
+    with _pending_lock:
+        if key in _pending:
+            return
+        _pending.add(key)
+    if _shares_memory_database():
+        # Worker threads cannot see an in-memory database (as used by the
+        # test runner) without locking it, so render in place.
+        _run(name, geometry, options)
+        return
+    _get_executor().submit(_run_in_worker, name, geometry, options)
+
+
+def schedule(post):
+    """Queue thumbnails of ``post.image`` once the post is committed."""
+    if not post.image:
+        return
+    name = post.image.name
+
+    def submit():
+        for geometry, options in SIZES:
+            _submit(name, geometry, options)
+
+    transaction.on_commit(submit)
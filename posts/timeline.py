@@ -0,0 +1,95 @@
+from django.core.exceptions import EmptyResultSet
+from django.db import connection, transaction
+
+from .models import Follow, Post, TimelineEntry
+
+BATCH_SIZE = 500
+
+
+def _entries(user_id, posts):
+    return [TimelineEntry(user_id=user_id,
+                          post_id=post_id,
+                          author_id=author_id,
+                          pub_date=pub_date)
+            for post_id, author_id, pub_date in posts]
+
+
+def fan_out_post(post):
+    """Push a new post into the timeline of every follower of its author."""
+    followers = Follow.objects.filter(
+        author_id=post.author_id).values_list('user_id', flat=True)
+    row = [(post.id, post.author_id, post.pub_date)]
+    entries = [entry for user_id in followers.iterator()
+               for entry in _entries(user_id, row)]
+    TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE,
+                                      ignore_conflicts=True)
+
+
+def _insert_entries(follows, posts):
+    """One INSERT ... SELECT of an entry per follow and post of its author.
+
+    Used for batch work instead of a bulk_create per follow: celebrity
+    authors put hundreds of thousands of rows into a full rebuild.
+    Entries that already exist are left alone, as in ``fan_out_post``.
+    """
+    try:
+        follows_sql, follows_params = follows.order_by().values(
+            'user_id', 'author_id').query.sql_with_params()
+        posts_sql, posts_params = posts.order_by().values(
+            'id', 'author_id', 'pub_date').query.sql_with_params()
+    except EmptyResultSet:  # e.g. an empty id__in list
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            '{insert} {entries} (user_id, post_id, author_id, pub_date) '
+            'SELECT f.user_id, p.id, p.author_id, p.pub_date '
+            'FROM ({follows}) f INNER JOIN ({posts}) p '
+            'ON p.author_id = f.author_id {suffix}'.format(
+                insert=connection.ops.insert_statement(
+                    ignore_conflicts=True),
+                entries=connection.ops.quote_name(
+                    TimelineEntry._meta.db_table),
+                follows=follows_sql,
+                posts=posts_sql,
+                suffix=connection.ops.ignore_conflicts_suffix_sql(
+                    ignore_conflicts=True)),
+            follows_params + posts_params)
+
+
+def fan_out_posts(post_ids):
+    """``fan_out_post`` for a batch of new posts."""
+    _insert_entries(Follow.objects.all(),
+                    Post.objects.filter(id__in=post_ids))
+
+
+def add_follows(follow_ids):
+    """``add_author`` for a batch of new follows."""
+    _insert_entries(Follow.objects.filter(id__in=follow_ids),
+                    Post.objects.all())
+
+
+def add_author(user_id, author_id):
+    """Backfill ``user_id``'s timeline with everything ``author_id`` wrote."""
+    posts = Post.objects.filter(author_id=author_id).values_list(
+        'id', 'author_id', 'pub_date')
+    TimelineEntry.objects.bulk_create(
+        _entries(user_id, posts.iterator()), batch_size=BATCH_SIZE,
+        ignore_conflicts=True)
+
+
+def remove_author(user_id, author_id):
+    TimelineEntry.objects.filter(user_id=user_id,
+                                 author_id=author_id).delete()
+
+
+@transaction.atomic
+def rebuild(user_ids=None):
+    """Recreate timelines from Follow and Post; returns rows written."""
+    follows = Follow.objects.all()
+    entries = TimelineEntry.objects.all()
+    if user_ids is not None:
+        follows = follows.filter(user_id__in=user_ids)
+        entries = entries.filter(user_id__in=user_ids)
+    entries.delete()
+    _insert_entries(follows, Post.objects.all())
+    return entries.count()
@@ -0,0 +1,131 @@
+"""Trending posts: comment velocity with exponential time decay.
+
+A comment made at time t adds exp(-(now - t) / tau) to its post's
+velocity. Every post decays at the same rate, so ranking by
+log(sum exp(x_i)), with x = (t - EPOCH) / tau, gives the same order at
+any moment and never needs recomputing. That log-sum is the stored
+``TrendingScore.score``. A new comment folds its x in with one atomic
+UPDATE (``EXP`` and ``LN`` exist on every backend Django supports,
+SQLite included), which also bumps the row's stored comment count.
+
+Scores only grow, so ``compact`` periodically drops the posts whose
+velocity has decayed below ``CUTOFF`` (relative to one fresh comment)
+and keeps at most ``POSTS_TRENDING_SIZE`` rows. That keeps the feed's
+cost independent of the size of the site.
+"""
+import datetime
+import math
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Abs, Exp, Greatest, Ln
+from django.utils import timezone
+
+from .models import Comment, TrendingScore
+
+EPOCH = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+# Velocity below exp(-CUTOFF) of one fresh comment is not trending.
+CUTOFF = 7
+# Placeholder score of a new row: the first comment replaces it.
+FLOOR = -1e9
+BATCH_SIZE = 500
+
+
+def position(when):
+    """``when`` on the score scale: decay periods since ``EPOCH``."""
+    tau = settings.POSTS_TRENDING_DECAY_HOURS * 3600
+    return (when - EPOCH).total_seconds() / tau
+
+
+def _add(post_id, x, comments):
+    # log(exp(score) + exp(x)), computed without overflow.
+    combined = Greatest(F('score'), Value(x)) + Ln(
+        Value(1.0) + Exp(Abs(F('score') - Value(x)) * -1))
+    changes = {'score': combined,
+               'comment_count': F('comment_count') + comments}
+    scores = TrendingScore.objects.filter(post_id=post_id)
+    if scores.update(**changes):
+        return
+    # The new comments are saved already: the update adds them back.
+    total = Comment.objects.filter(post_id=post_id).count()
+    TrendingScore.objects.bulk_create(
+        [TrendingScore(post_id=post_id, score=FLOOR,
+                       comment_count=max(total - comments, 0))],
+        ignore_conflicts=True)
+    scores.update(**changes)
+
+
+def _log_sum(values):
+    top = max(values)
+    return top + math.log(sum(math.exp(value - top) for value in values))
+
+
+def _positions(comments):
+    """Positions of the ``(post_id, created)`` pairs per post, leaving
+    out comments too old to matter (an empty list if all are)."""
+    floor = position(timezone.now()) - CUTOFF
+    per_post = defaultdict(list)
+    for post_id, created in comments:
+        x = position(created)
+        values = per_post[post_id]
+        if x >= floor:
+            values.append(x)
+    return per_post
+
+
+def _scores(comments):
+    return {post_id: _log_sum(values)
+            for post_id, values in _positions(comments).items() if values}
+
+
+def record_comments(comments):
+    """Fold ``(post_id, created)`` pairs into the scores."""
+    comments = list(comments)
+    counts = Counter(post_id for post_id, _ in comments)
+    for post_id, values in _positions(comments).items():
+        if values:
+            _add(post_id, _log_sum(values), counts[post_id])
+        else:  # not trending, but a listed post must count it
+            TrendingScore.objects.filter(post_id=post_id).update(
+                comment_count=F('comment_count') + counts[post_id])
+
+
+def record_comment(comment):
+    record_comments([(comment.post_id, comment.created)])
+
+
+def forget_comment(comment):
+    TrendingScore.objects.filter(
+        post_id=comment.post_id, comment_count__gt=0,
+    ).update(comment_count=F('comment_count') - 1)
+
+
+def compact():
+    """Drop decayed and surplus rows; returns how many were deleted."""
+    floor = position(timezone.now()) - CUTOFF
+    with transaction.atomic():
+        deleted, _ = TrendingScore.objects.filter(score__lt=floor).delete()
+        keep = TrendingScore.objects.order_by('-score', '-post').values(
+            'post')[:settings.POSTS_TRENDING_SIZE]
+        surplus, _ = TrendingScore.objects.exclude(post__in=keep).delete()
+    return deleted + surplus
+
+
+def rebuild():
+    """Recompute every score from recent comments; returns the row count."""
+    tau = datetime.timedelta(hours=settings.POSTS_TRENDING_DECAY_HOURS)
+    since = timezone.now() - tau * CUTOFF
+    scores = _scores(Comment.objects.filter(created__gte=since).values_list(
+        'post_id', 'created').iterator())
+    with transaction.atomic():
+        TrendingScore.objects.all().delete()
+        TrendingScore.objects.bulk_create(
+            [TrendingScore(post_id=post_id, score=score)
+             for post_id, score in scores.items()], batch_size=BATCH_SIZE)
+        compact()
+        TrendingScore.objects.update(comment_count=Subquery(
+            Comment.objects.filter(post=OuterRef('post')).order_by().values(
+                'post').annotate(total=Count('id')).values('total')))
+        return TrendingScore.objects.count()
@@ -0,0 +1,51 @@
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+
+from .validators import file_size_error, image_dimensions_error, is_too_large
+
+# Enough bytes for the header of every format Pillow opens lazily.
+PROBE_BYTES = 64 * 1024
+
+
+class LimitedUploadHandler(FileUploadHandler):
+    """Reject oversized uploads while they stream in.
+
+    Runs before the storing handlers. As soon as a file passes
+    ``POSTS_MAX_UPLOAD_SIZE`` bytes, or its header announces more than
+    ``POSTS_MAX_IMAGE_PIXELS`` pixels, the rest of the request body is
+    left unread and the reason is recorded in
+    ``request.rejected_uploads`` for the form to report.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.head = BytesIO()
+        self.probed = False
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.POSTS_MAX_UPLOAD_SIZE:
+            self.reject(file_size_error())
+        if not self.probed:
+            self.probe(raw_data)
+        return raw_data
+
+    def probe(self, raw_data):
+        self.head.write(raw_data[:PROBE_BYTES - self.head.tell()])
+        self.head.seek(0)
+        if is_too_large(self.head):
+            self.reject(image_dimensions_error())
+        self.head.seek(0, 2)
+        self.probed = self.head.tell() >= PROBE_BYTES
+
+    def reject(self, error):
+        if not hasattr(self.request, 'rejected_uploads'):
+            self.request.rejected_uploads = {}
+        self.request.rejected_uploads[self.field_name] = error
+        raise StopUpload(connection_reset=True)
+
+    def file_complete(self, file_size):
+        return None
@@ -16,6 +16,15 @@ urlpatterns = [
      path('group/<slug:slug>/',
           views.group_posts,
           name='group_posts'),
+     path('trending/',
+          views.trending,
+          name='trending'),
+     path('search/',
+          views.search,
+          name='search'),
+     path('export/',
+          views.export_content,
+          name='export_content'),
      path('<str:username>/',
           views.profile,
           name='profile'),
@@ -28,6 +37,9 @@ urlpatterns = [
      path('<str:username>/<int:post_id>/',
           views.post_view,
           name='post_view'),
+     path('<str:username>/<int:post_id>/comments/',
+          views.post_comments,
+          name='post_comments'),
      path('<str:username>/<int:post_id>/edit/',
           views.post_edit,
           name='post_edit'),
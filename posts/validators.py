@@ -1,10 +1,58 @@
+from django.conf import settings
 from django.core.exceptions import ValidationError
+from PIL import Image
+
+
+def file_size_error():
+    limit = settings.POSTS_MAX_UPLOAD_SIZE // (1024 * 1024)
+    return ValidationError(
+            'Максимальный разрешенный размер файла %sMB' % str(limit))
+
+
+def image_dimensions_error():
+    return ValidationError(
+            'Изображение слишком большое: разрешено не более %s пикселей'
+            % str(settings.POSTS_MAX_IMAGE_PIXELS))
 
 
 def validate_file_size(file):
 
     imagesize = file.file.size
-    limit = 1
-    if imagesize > limit*1024*1024:
-        raise ValidationError(
-                'Максимальный разрешенный размер файла %sMB' % str(limit))
+    if imagesize > settings.POSTS_MAX_UPLOAD_SIZE:
+        raise file_size_error()
+
+
+def probe_dimensions(file):
+    """Read (width, height) from the image header without decoding it.
+
+    Returns None when the header cannot be parsed; raises
+    ``Image.DecompressionBombError`` for images Pillow refuses outright.
+    """
+    try:
+        with Image.open(file) as image:
+            return image.size
+    except (OSError, SyntaxError, ValueError):
+        return None
+
+
+def is_too_large(file):
+    try:
+        size = probe_dimensions(file)
+    except Image.DecompressionBombError:
+        return True
+    return bool(size) and size[0] * size[1] > settings.POSTS_MAX_IMAGE_PIXELS
+
+
+def validate_image_dimensions(file):
+
+    if getattr(file, '_committed', False):
+        # Stored files were checked when they were uploaded.
+        return
+    upload = file.file
+    position = upload.tell()
+    try:
+        too_large = is_too_large(upload)
+    finally:
+        upload.seek(position)
+    if too_large:
+        raise image_dimensions_error()
@@ -1,54 +1,122 @@
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
+from django.db import IntegrityError, transaction
+from django.db.models import Exists
+from django.http import (HttpResponseBadRequest, JsonResponse,
+                         StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 
+from . import entities, export, suggestions, thumbnails, trending
+from .caching import feed_fragment
+from .conditional import (conditional, group_validators, post_validators,
+                          profile_validators)
 from .forms import CommentForm, PostForm
-from .models import Group, Post, User, Follow
+from .models import Follow, Post, TrendingScore, UserStats, comment_count
+from .pagination import (COMMENTS_PAGE_SIZE, PAGE_SIZE, CursorPaginator,
+                         paginate)
+from .search import SearchResults
 
 
 def index(request):
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = Post.objects.for_feed()
+    paginator, page = paginate(request, post_list)
     return render(request, 'index.html', {
         'page': page,
         'paginator': paginator,
+        **feed_fragment(request, paginator, page, 'index'),
     })
 
 
+def _timeline_post(entry):
+    entry.post.comment_count = entry.comment_count
+    return entry.post
+
+
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(
-        author__following__user=request.user
-    )
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    entries = request.user.timeline.select_related(
+        'post__author', 'post__group'
+    ).annotate(
+        comment_count=comment_count('post')
+    ).order_by('-pub_date', '-id')
+    paginator, page = paginate(request, entries)
+    page.object_list = [_timeline_post(entry) for entry in page.object_list]
     return render(request, 'follow.html', {
         'page': page,
         'paginator': paginator,
+        'suggestions': suggestions.for_user(request.user),
+    })
+
+
+def trending(request):
+    ordering = ('-score', '-post_id')
+    # The row carries the comment count: no per-request aggregation.
+    entries = TrendingScore.objects.select_related(
+        'post__author', 'post__group'
+    ).order_by(*ordering)
+    paginator, page = paginate(request, entries, ordering)
+    page.object_list = [_timeline_post(entry) for entry in page.object_list]
+    return render(request, 'trending.html', {
+        'page': page,
+        'paginator': paginator,
     })
 
 
+@conditional(group_validators)
 def group_posts(request, slug):
-    group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()  # type: ignore
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    group = entities.groups.get_or_404(slug)
+    post_list = group.posts.for_feed()  # type: ignore
+    paginator, page = paginate(request, post_list)
     return render(request, 'group.html', {
         'group': group,
         'page': page,
         'paginator': paginator,
+        **feed_fragment(request, paginator, page, f'group:{group.id}'),
+    })
+
+
+def _post_form(request, **kwargs):
+    data = request.POST or None  # parses the body, running the handlers
+    rejected = getattr(request, 'rejected_uploads', None)
+    if rejected:
+        # The body was cut short, so bind even if no fields arrived:
+        # the form must report the rejection.
+        data = request.POST
+    return PostForm(data,
+                    files=request.FILES or None,
+                    rejected_uploads=rejected,
+                    **kwargs)
+
+
+def search(request):
+    query = request.GET.get('q', '').strip()
+    paginator = Paginator(SearchResults(query), PAGE_SIZE)
+    page = paginator.get_page(request.GET.get('page'))
+    return render(request, 'search.html', {
+        'query': query,
+        'page': page,
+        'paginator': paginator,
     })
 
 
+@login_required
+def export_content(request):
+    fmt = request.GET.get('format', 'ndjson')
+    if fmt not in export.FORMATS:
+        return HttpResponseBadRequest('Неизвестный формат')
+    images = 'images' in request.GET
+    response = StreamingHttpResponse(
+        export.chunks(request.user, fmt, images),
+        content_type=export.content_type(fmt, images))
+    response['Content-Disposition'] = 'attachment; filename="%s"' % (
+        export.filename(request.user, fmt, images))
+    return response
+
+
 @login_required
 def new_post(request):
-    form = PostForm(request.POST or None,
-                    files=request.FILES or None)
+    form = _post_form(request)
     if not form.is_valid():
         return render(request, 'new_post.html', {
             'form': form,
@@ -57,44 +125,85 @@ def new_post(request):
     post = form.save(commit=False)
     post.author = request.user
     post.save()
+    thumbnails.schedule(post)
     return redirect(reverse('index'))
 
 
+@conditional(profile_validators)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    post_list = author.posts.all()  # type: ignore
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    following = None
+    author = entities.users.get_or_404(username)
+    post_list = author.posts.for_feed()  # type: ignore
+    paginator, page = paginate(request, post_list)
+    # The counters and the follow button in one query.
+    stats = UserStats.objects.filter(user=author)
     if request.user.is_authenticated:
-        following = Follow.objects.filter(user=request.user,
-                                          author=author).exists()
+        stats = stats.annotate(viewer_follows=Exists(Follow.objects.filter(
+            user=request.user, author=author)))
+    author.stats = stats.first()
+    following = getattr(author.stats, 'viewer_follows', None)
     return render(request, 'profile.html', {
         'author': author,
         'page': page,
         'paginator': paginator,
         'following': following,
+        'suggestions': suggestions.for_user(request.user),
+        **feed_fragment(request, paginator, page, f'author:{author.id}'),
     })
 
 
+def _comment_page(post, cursor):
+    comments = post.comments.select_related('author')
+    paginator = CursorPaginator(comments, COMMENTS_PAGE_SIZE,
+                                ordering=('created', 'id'))
+    return comments, paginator.get_page(cursor)
+
+
+@conditional(post_validators)
 def post_view(request, username, post_id):
     form_comment = CommentForm()
-    post = get_object_or_404(Post, id=post_id, author__username=username)
+    author = entities.users.get_or_404(username)
+    post = get_object_or_404(
+        Post.objects.for_feed().select_related('author__stats'),
+        id=post_id, author_id=author.pk)
+    # ?comments= is the no-JavaScript fallback of the "more" button.
+    comments, comment_page = _comment_page(post, request.GET.get('comments'))
     return render(request, 'post.html', {
         'author': post.author,
         'post': post,
+        'comments': comments,
+        'comment_page': comment_page,
         'form': form_comment,
     })
 
 
+@conditional(post_validators)
+def post_comments(request, username, post_id):
+    post = get_object_or_404(Post.objects.select_related('author'),
+                             id=post_id, author__username=username)
+    _, page = _comment_page(post, request.GET.get('cursor'))
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'comments': [{
+                'id': comment.id,
+                'author': comment.author.username,
+                'text': comment.text,
+                'created': comment.created,
+            } for comment in page],
+            'next': page.next_cursor,
+        })
+    return render(request, 'includes/comment_list.html', {
+        'post': post,
+        'comment_page': page,
+    })
+
+
 @login_required
 def add_comment(request, username, post_id):
     post = get_object_or_404(Post,
                              id=post_id)
     form = CommentForm(request.POST or None)
     if not form.is_valid():
-        return render(request, 'comments.html', {
+        return render(request, 'includes/comments.html', {
             'post': post,
             'form': form,
         })
@@ -108,14 +217,13 @@ def add_comment(request, username, post_id):
 
 @login_required
 def post_edit(request, username, post_id):
-    post = get_object_or_404(Post, id=post_id, author__username=username)
+    author = entities.users.get_or_404(username)
+    post = get_object_or_404(Post, id=post_id, author_id=author.pk)
     if request.user.username != username:
         return redirect('post_view', username=username, post_id=post_id)
-    form = PostForm(request.POST or None,
-                    files=request.FILES or None,
-                    instance=post)
+    form = _post_form(request, instance=post)
     if form.is_valid():
-        form.save()
+        thumbnails.schedule(form.save())
         return redirect('post_view', username=username, post_id=post_id)
 
     return render(request, 'new_post.html', {
@@ -126,20 +234,22 @@ def post_edit(request, username, post_id):
 
 @login_required
 def profile_follow(request, username):
-    author = get_object_or_404(User, username=username)
-    follow = Follow.objects.filter(user=request.user,
-                                   author=author).exists()
-    if request.user != author and not follow:
-        Follow.objects.create(user=request.user, author=author)
+    author = entities.users.get_or_404(username)
+    if request.user != author:
+        # The unique constraint is the existence check: one INSERT, and
+        # a concurrent duplicate is simply ignored.
+        try:
+            with transaction.atomic():
+                Follow.objects.create(user=request.user, author=author)
+        except IntegrityError:
+            pass
     return redirect("profile", username=username)
 
 
 @login_required
 def profile_unfollow(request, username):
-    author = get_object_or_404(User, username=username)
-    follow = Follow.objects.filter(user=request.user, author=author)
-    if follow.exists():
-        follow.delete()
+    author = entities.users.get_or_404(username)
+    Follow.objects.filter(user=request.user, author=author).delete()
     return redirect("profile", username=username)
 
 
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+USER_KEY = 'users:user:%s'
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend that keeps the logged-in user in the cache.
+
+    Spares the ``auth_user`` read of every request; users.signals drops
+    the entry whenever the user is saved (password changes included) or
+    deleted.
+    """
+
+    def get_user(self, user_id):
+        key = USER_KEY % user_id
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, settings.USERS_CACHE_TTL)
+        return user
@@ -1,5 +1,7 @@
+from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import get_user_model
+from django.urls import URLResolver, get_resolver
 
 
 User = get_user_model()
@@ -12,4 +14,26 @@ class CreationForm(UserCreationForm):
         # укажем модель, с которой связана создаваемая форма
         model = User
         # укажем, какие поля должны быть видны в форме и в каком порядке
-        fields = ("first_name", "last_name", "username", "email")
\ No newline at end of file
+        fields = ("first_name", "last_name", "username", "email")
+
+    def clean_username(self):
+        username = self.cleaned_data['username']
+        # профиль /<username>/ не должен совпадать со страницей сайта,
+        # например /search/
+        if username.lower() in reserved_usernames():
+            raise forms.ValidationError('Это имя пользователя недоступно')
+        return username
+
+
+def reserved_usernames(patterns=None):
+    """First path segments taken by the site's own pages."""
+    if patterns is None:
+        patterns = get_resolver().url_patterns
+    names = set()
+    for pattern in patterns:
+        route = str(pattern.pattern).lstrip('^')
+        if not route and isinstance(pattern, URLResolver):
+            names |= reserved_usernames(pattern.url_patterns)
+        elif route and '<' not in route.split('/')[0]:
+            names.add(route.split('/')[0].lower())
+    return names
@@ -1,3 +1,57 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
-# Create your tests here.
+from .backends import USER_KEY
+
+
+class TestCachedAuthentication(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='cached_user',
+                                              password='old-secret-1')
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def tables_read(self, url):
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(url)
+        return ' '.join(query['sql'] for query in captured.captured_queries)
+
+    def test_warm_requests_skip_session_and_user_reads(self):
+        url = reverse('new_post')
+        self.tables_read(url)
+        sql = self.tables_read(url)
+        self.assertNotIn('"django_session"', sql)
+        self.assertNotIn('"auth_user"', sql)
+
+    def test_saving_the_user_drops_the_cached_copy(self):
+        self.client.get(reverse('new_post'))
+        self.assertIsNotNone(cache.get(USER_KEY % self.user.pk))
+        self.user.set_password('new-secret-2')
+        self.user.save()
+        self.assertIsNone(cache.get(USER_KEY % self.user.pk))
+        # The session was made with the old password: it is logged out.
+        response = self.client.get(reverse('new_post'))
+        self.assertEqual(response.status_code, 302)
+
+
+class TestSignUp(TestCase):
+
+    def signup(self, username):
+        return self.client.post(reverse('signup'), {
+            'username': username, 'email': 'new@example.com',
+            'password1': 'long-secret-42', 'password2': 'long-secret-42',
+        })
+
+    def test_usernames_of_site_pages_are_refused(self):
+        for username in ('search', 'Trending', 'export', 'admin'):
+            with self.subTest(username=username):
+                response = self.signup(username)
+                self.assertFormError(response, 'form', 'username',
+                                     'Это имя пользователя недоступно')
+        self.assertFalse(User.objects.exists())
+        self.signup('searcher')
+        self.assertTrue(User.objects.filter(username='searcher').exists())
@@ -50,11 +50,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'posts.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'posts.routers.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -64,7 +66,7 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'posts.metrics.DjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -88,9 +90,34 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        'CONN_MAX_AGE': 60,
+    },
+    # A read replica of default; only used once listed in POSTS_DB_REPLICAS
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.replica.sqlite3'),
+        'CONN_MAX_AGE': 60,
+    },
 }
 
+# Set on every new SQLite connection (posts.signals). WAL gives readers a
+# snapshot while one writer appends; writers wait for the lock up to
+# busy_timeout ms instead of failing with "database is locked"
+POSTS_SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',  # safe in WAL; a power cut may lose recent commits
+    'busy_timeout': 5000,
+    'cache_size': -32000,  # KiB
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'memory',
+}
+
+# Read-only views read from these aliases (posts.routers); writers stay
+# on the primary for a while so they see their own changes
+DATABASE_ROUTERS = ['posts.routers.PrimaryReplicaRouter']
+POSTS_DB_REPLICAS = []
+POSTS_PRIMARY_PIN_SECONDS = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -134,6 +161,9 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media') 
 
+# Post images are stored once per distinct content (posts.media)
+DEFAULT_FILE_STORAGE = 'posts.media.ContentAddressedStorage'
+
 
 LOGIN_URL = "/auth/login/"
 LOGIN_REDIRECT_URL = "index" 
@@ -144,8 +174,73 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 
 SITE_ID = 1
 
+# Each worker keeps a small LRU in front of the cache all workers share;
+# invalidation goes through versions kept in the shared tier only.
+# The shared files are culled at most once a minute rather than on every
+# write (posts.cache_backends.FileBasedCache); tests swap in an in-memory
+# tier (yatube.test_settings).
+SHARED_CACHE = {
+    'BACKEND': 'posts.cache_backends.FileBasedCache',
+    'LOCATION': os.environ.get('YATUBE_CACHE_DIR',
+                               os.path.join(BASE_DIR, 'cache')),
+    'OPTIONS': {'MAX_ENTRIES': 100000, 'CULL_INTERVAL': 60},
+}
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'posts.cache_backends.TwoTierCache',
+        'LOCATION': 'default',
+        'OPTIONS': {
+            'SHARED': SHARED_CACHE,
+            'LOCAL_MAX_ENTRIES': 2000,
+            'LOCAL_TIMEOUT': 60,
+            'SHARED_ONLY': ['posts:version:', 'users:user:',
+                            'django.contrib.sessions.'],
+        },
     }
 }
+
+# Keyset pagination for post feeds; when off, it is still used for
+# requests that carry a ``cursor`` query parameter
+POSTS_CURSOR_PAGINATION = False
+
+# Feed fragments are invalidated through versioned keys on Post/Comment
+# changes, so the TTL only bounds how long unused fragments linger
+POSTS_FRAGMENT_CACHE_TTL = 60 * 60
+# Post cards are keyed on their content (posts.cards) and never go stale
+POSTS_CARD_CACHE_TTL = 24 * 60 * 60
+
+# Thumbnails are rendered off-request: at upload time and by the
+# generate_thumbnails command; templates never wait for Pillow
+THUMBNAIL_BACKEND = 'posts.thumbnails.DeferredThumbnailBackend'
+THUMBNAIL_WORKERS = 2
+
+# Upload limits, enforced while the request body streams in
+POSTS_MAX_UPLOAD_SIZE = 1024 * 1024
+POSTS_MAX_IMAGE_PIXELS = 4096 * 4096
+
+FILE_UPLOAD_HANDLERS = [
+    'posts.uploadhandlers.LimitedUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Trending feed (posts.trending): comments lose 1/e of their weight every
+# DECAY_HOURS; compact_trending keeps at most SIZE ranked posts
+POSTS_TRENDING_DECAY_HOURS = 6
+POSTS_TRENDING_SIZE = 1000
+
+# Per-process cache of groups by slug and users by username (posts.entities)
+POSTS_ENTITY_CACHE_SIZE = 1000
+POSTS_ENTITY_CACHE_TTL = 60
+
+# Sessions are read from the cache and written through to the database;
+# the logged-in user is cached too (users.backends)
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+AUTHENTICATION_BACKENDS = ['users.backends.CachedModelBackend']
+USERS_CACHE_TTL = 5 * 60
+
+# Request metrics are served at /metrics/ to staff and to scrapers that
+# send "Authorization: Bearer <token>"; no token, no scraping
+POSTS_METRICS_TOKEN = os.environ.get('YATUBE_METRICS_TOKEN')
+# Requests at least this slow are logged to "posts.slow" with their SQL
+POSTS_SLOW_REQUEST_SECONDS = None
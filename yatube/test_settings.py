@@ -0,0 +1,16 @@
+"""Settings for the test runs.
+
+    python manage.py test --settings=yatube.test_settings
+
+pytest picks them up from pytest.ini. Tests clear the cache freely, so
+the shared tier is a private in-memory one instead of the cache
+directory the running site uses.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import CACHES
+
+CACHES['default']['OPTIONS']['SHARED'] = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'shared',
+    'OPTIONS': {'MAX_ENTRIES': 100000},
+}
@@ -7,6 +7,8 @@ from django.contrib.flatpages import views
 
 from django.urls import include, path
 
+from posts.metrics import metrics_view
+
 
 urlpatterns = [
         path('about-us/', views.flatpage, {'url': '/about-us/'}, name='about'),
@@ -15,6 +17,8 @@ urlpatterns = [
         path('about-spec/', views.flatpage, {'url': '/about-spec/'}, name='about-spec'),
         path('admin/', admin.site.urls),
         path('about/', include('django.contrib.flatpages.urls')),
+        path('api/v1/', include('posts.api_urls')),
+        path('metrics/', metrics_view, name='metrics'),
         path('auth/', include('users.urls')),
         path('auth/', include('django.contrib.auth.urls')),
         path('', include('posts.urls')),